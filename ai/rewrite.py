@@ -1,20 +1,27 @@
-import os, requests
+import os, asyncio, hashlib, logging, random
+from typing import Dict, List, Optional
+import aiohttp
+from storage.db import db_call, db_write, get_rewrites, put_rewrites
+from utils.metrics import Counter, Histogram
+from utils.ratelimit import TokenBucket
 
 TONE_INSTRUCTIONS = (
     "Ты — редактор канала NXT Esports. Пиши кратко, дерзко, по делу. "
     "Структура: 1) факт (1–2 предложения), 2) контекст/мнение (1–2 предложения), "
     "3) вопрос для вовлечения, 4) 2–4 хэштега. Без воды."
 )
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+REWRITE_SECONDS = Histogram("nxt_rewrite_seconds", "OpenRouter request time")
+REWRITE_REQUESTS = Counter("nxt_rewrite_requests_total", "OpenRouter requests by result", ["result"])
+REWRITE_CACHE = Counter("nxt_rewrite_cache_total", "Rewrite cache lookups", ["result"])
 
-def rewrite_text(text: str) -> str:
-    api_key = os.getenv("OPENROUTER_API_KEY", "")
-    if not api_key:
-        # No AI key; return trimmed original
-        return text.strip()
-    base = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
-    model = os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat")
+def _settings():
+    return (os.getenv("OPENROUTER_API_KEY", ""),
+            os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+            os.getenv("OPENROUTER_MODEL", "deepseek/deepseek-chat"))
 
-    payload = {
+def _payload(model: str, text: str) -> dict:
+    return {
         "model": model,
         "messages": [
             {"role": "system", "content": TONE_INSTRUCTIONS},
@@ -23,16 +30,107 @@ def rewrite_text(text: str) -> str:
         "temperature": 0.7,
         "max_tokens": 240,
     }
-    headers = {
+
+def _headers(api_key: str) -> dict:
+    return {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
         "HTTP-Referer": "https://nxt-esports-bot.local",
         "X-Title": "NXT Esports Bot",
     }
+
+def cache_key(model: str, text: str) -> str:
+    prompt = hashlib.sha256(TONE_INSTRUCTIONS.encode()).hexdigest()[:16]
+    return f"{model}:{prompt}:{hashlib.sha256(text.strip().encode()).hexdigest()}"
+
+def rewrite_text(text: str) -> str:
+    api_key, base, model = _settings()
+    if not api_key:
+        # No AI key; return trimmed original
+        return text.strip()
+    key = cache_key(model, text)
+    cached = get_rewrites([key])
+    if key in cached:
+        return cached[key]
     try:
-        r = requests.post(f"{base}/chat/completions", json=payload, headers=headers, timeout=30)
+        import requests  # sync fallback only; not loaded at startup
+        r = requests.post(f"{base}/chat/completions", json=_payload(model, text), headers=_headers(api_key), timeout=30)
         r.raise_for_status()
         data = r.json()
-        return data["choices"][0]["message"]["content"].strip()
+        out = data["choices"][0]["message"]["content"].strip()
     except Exception as e:
         return text.strip()
+    put_rewrites({key: out})
+    return out
+
+class RewritePool:
+    # Async OpenRouter client: bounded concurrency, token-bucket rate limit, retries on 429/5xx
+    # and a persistent cache, so the same input is never paid for twice.
+    def __init__(self, *, concurrency: int = 4, rate: float = 1.0, burst: int = 4, retries: int = 4,
+                 timeout: float = 30.0, backoff: float = 1.0, api_key: Optional[str] = None,
+                 base_url: Optional[str] = None, model: Optional[str] = None):
+        env_key, env_base, env_model = _settings()
+        self.api_key = env_key if api_key is None else api_key
+        self.base_url = base_url or env_base
+        self.model = model or env_model
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+
+    async def _call(self, session: aiohttp.ClientSession, sem: asyncio.Semaphore, text: str) -> Optional[str]:
+        async with sem:
+            for attempt in range(self.retries + 1):
+                await self.bucket.acquire()
+                delay = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+                try:
+                    with REWRITE_SECONDS.time():
+                        async with session.post(f"{self.base_url}/chat/completions", json=_payload(self.model, text),
+                                                timeout=aiohttp.ClientTimeout(total=self.timeout)) as r:
+                            if r.status in RETRY_STATUSES:
+                                retry_after = r.headers.get("Retry-After", "")
+                                if retry_after.isdigit():
+                                    delay = max(delay, float(retry_after))
+                                logging.warning("rewrite got HTTP %s (attempt %s)", r.status, attempt + 1)
+                                REWRITE_REQUESTS.inc("retry")
+                            else:
+                                r.raise_for_status()
+                                data = await r.json(content_type=None)
+                                REWRITE_REQUESTS.inc("ok")
+                                return data["choices"][0]["message"]["content"].strip()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if isinstance(e, aiohttp.ClientResponseError):
+                        logging.warning("rewrite failed: %r", e)
+                        REWRITE_REQUESTS.inc("error")
+                        return None
+                    logging.warning("rewrite error %r (attempt %s)", e, attempt + 1)
+                    REWRITE_REQUESTS.inc("retry")
+                except (KeyError, IndexError, TypeError, ValueError) as e:
+                    logging.warning("rewrite bad response: %r", e)
+                    REWRITE_REQUESTS.inc("error")
+                    return None
+                if attempt < self.retries:
+                    await asyncio.sleep(delay)
+        return None
+
+    async def rewrite_many(self, texts: List[str]) -> List[str]:
+        # Rewrites in input order; failed calls fall back to the trimmed original and are not cached.
+        if not self.api_key or not texts:
+            return [t.strip() for t in texts]
+        keys = [cache_key(self.model, t) for t in texts]
+        done: Dict[str, str] = await db_call(get_rewrites, keys)
+        todo = {k: t for k, t in zip(keys, texts) if k not in done}
+        REWRITE_CACHE.inc("hit", amount=len(texts) - len(todo))
+        REWRITE_CACHE.inc("miss", amount=len(todo))
+        if todo:
+            sem = asyncio.Semaphore(self.concurrency)
+            async with aiohttp.ClientSession(headers=_headers(self.api_key)) as session:
+                results = await asyncio.gather(*(self._call(session, sem, t) for t in todo.values()))
+            fresh = {k: out for k, out in zip(todo, results) if out}
+            await db_write(put_rewrites, fresh)
+            done.update(fresh)
+        return [done.get(k, t.strip()) for k, t in zip(keys, texts)]
+
+    async def rewrite(self, text: str) -> str:
+        return (await self.rewrite_many([text]))[0]
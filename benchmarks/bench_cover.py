@@ -0,0 +1,63 @@
+# Covers per second: legacy pipeline vs cached engine vs process pool.
+# Usage: python benchmarks/bench_cover.py [-n 24]
+import argparse, asyncio, os, sys, tempfile, time
+from PIL import Image
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from media import cover
+
+TITLES = [
+    "NAVI beat FaZe in a triple-overtime thriller to reach the grand final of IEM Cologne",
+    "Team Spirit clutch 1v3 on Inferno",
+    "Самые безумные моменты недели: эйсы, клатчи и ультракиллы на профессиональной сцене Dota 2 и CS2",
+] * 8
+
+def _legacy_overlay(img):
+    grad = Image.new("L", (1, cover.HEIGHT), color=0)
+    for y in range(cover.HEIGHT):
+        grad.putpixel((0, y), int(180 * (y/cover.HEIGHT)))
+    grad = grad.resize((cover.WIDTH, cover.HEIGHT))
+    return Image.composite(Image.new("RGB", (cover.WIDTH, cover.HEIGHT), (0,0,0)), img, grad)
+
+def _legacy_fit_title(draw, text, maxw):
+    tfont = cover._load_font.__wrapped__(68)
+    lines = cover._wrap(draw, text, tfont, maxw)
+    while (len(lines) > 3 or max(draw.textlength(ln, font=tfont) for ln in lines) > maxw) and getattr(tfont, "size", 68) > 34:
+        tfont = cover._load_font.__wrapped__(getattr(tfont, "size", 68)-4)
+        lines = cover._wrap(draw, text, tfont, maxw)
+    return tfont, lines
+
+LEGACY = {"_overlay": _legacy_overlay, "_fit_title": _legacy_fit_title}
+
+def run_sequential(titles, out_dir):
+    t = time.perf_counter()
+    for title in titles:
+        cover.generate_cover(title, out_dir=out_dir)
+    return len(titles) / (time.perf_counter() - t)
+
+async def run_pool(titles, out_dir):
+    await cover.render_cover(titles[0], out_dir=out_dir)  # spin up workers
+    t = time.perf_counter()
+    await asyncio.gather(*(cover.render_cover(title, out_dir=out_dir) for title in titles))
+    return len(titles) / (time.perf_counter() - t)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=len(TITLES))
+    args = ap.parse_args()
+    titles = (TITLES * (args.n // len(TITLES) + 1))[:args.n]
+    with tempfile.TemporaryDirectory() as out_dir:
+        current = {name: getattr(cover, name) for name in LEGACY}
+        for name, fn in LEGACY.items():
+            setattr(cover, name, fn)
+        before = run_sequential(titles, out_dir)
+        for name, fn in current.items():
+            setattr(cover, name, fn)
+        after = run_sequential(titles, out_dir)
+        pooled = asyncio.run(run_pool(titles, out_dir))
+        cover.shutdown_pool()
+    print(f"legacy:          {before:6.2f} covers/s")
+    print(f"cached engine:   {after:6.2f} covers/s ({after / before:.2f}x)")
+    print(f"process pool:    {pooled:6.2f} covers/s ({pooled / before:.2f}x, {os.cpu_count()} CPUs)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# End-to-end ingest throughput, fully offline: stub feeds, stub OpenRouter and a fake Bot API run in a
+# separate process; this process runs the real bot pipeline (fetch_to_review + outbox dispatcher) in a
+# scratch directory with its own database. Per-item latency is cycle start -> review message delivered.
+# Usage: python benchmarks/bench_e2e.py [--cycles 5] [--feeds 40 --size 30 --churn 5] [--review-mode digest] [--out e2e.json]
+import argparse, asyncio, json, multiprocessing, os, resource, shutil, socket, sys, tempfile, time
+import aiohttp
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stubs
+
+TOKEN = "123456:bench"
+REVIEW_CHAT_ID = "-1001"
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))]
+
+def _write_sources(base: str, feeds: int, channels: int):
+    lines = ["games:", "  bench:", "    rss:"]
+    lines += [f"    - {base}/rss/{k}" for k in range(feeds)]
+    lines += ["    youtube_channels:"] + [f"    - ch{k}" for k in range(channels)]
+    lines += ["filters:", "  highlight_keywords:", "  - highlights", "  negative_keywords:", "  - trailer"]
+    with open("sources.yaml", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+def _configure(base: str, args):
+    # The bot reads its settings at import time.
+    os.environ.update({
+        "BOT_TOKEN": TOKEN, "REVIEW_CHAT_ID": REVIEW_CHAT_ID, "CHANNEL_ID": "-1002",
+        "OPENROUTER_API_KEY": "bench", "OPENROUTER_BASE_URL": f"{base}/v1",
+        "YOUTUBE_FEED_URL": f"{base}/yt?channel_id={{}}",
+        "REWRITE_CONCURRENCY": str(args.rewrite_concurrency), "REWRITE_RATE_PER_SEC": str(args.rewrite_rate),
+        "FEED_PER_HOST": str(args.per_host), "IMAGE_PREFETCH": "true" if args.prefetch else "false",
+        "REVIEW_MODE": args.review_mode,
+    })
+
+async def _wait(base: str, timeout: float = 30):
+    async with aiohttp.ClientSession() as session:
+        for _ in range(int(timeout * 20)):
+            try:
+                async with session.get(f"{base}/_bench/sent?since=0") as r:
+                    if r.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.05)
+    raise RuntimeError("stub server did not start")
+
+async def run(args, base: str) -> dict:
+    import logging
+    import bot
+    from telegram.ext import Application
+    from delivery.outbox import Dispatcher
+    from storage.db import pending_messages
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    bot.init_db()
+
+    app = Application.builder().token(TOKEN).base_url(f"{base}/bot").build()
+    dispatcher = Dispatcher(app.bot, rate=args.send_rate, per_chat_rate=args.send_chat_rate, per_chat_burst=max(1, int(args.send_chat_rate)))
+    cycles, latencies, seen = [], [], 0
+    async with app, aiohttp.ClientSession() as control:
+        dispatcher.start()
+        try:
+            for n in range(args.cycles):
+                if n:
+                    async with control.post(f"{base}/_bench/advance") as r:
+                        new_entries = (await r.json())["new_entries"]
+                else:
+                    new_entries = (args.feeds + args.channels) * args.size
+                start = time.time()
+                await bot.fetch_to_review(app)
+                fetched = time.time()
+                while await asyncio.to_thread(pending_messages):
+                    await asyncio.sleep(0.01)
+                elapsed = time.time() - start
+                await asyncio.gather(*list(bot.background_tasks), return_exceptions=True)
+                async with control.get(f"{base}/_bench/sent?since={seen}") as r:
+                    report = await r.json()
+                seen += len(report["sent"])
+                delivered = [m["t"] for m in report["sent"] for _ in m["item_ids"]]
+                latencies += [round((t - start) * 1000, 1) for t in delivered]
+                cycles.append({"cycle": n, "new_entries": new_entries, "items": len(delivered),
+                               "telegram_requests": len(report["sent"]),
+                               "fetch_seconds": round(fetched - start, 3), "seconds": round(elapsed, 3),
+                               "feeds": dict(bot.last_fetch_stats)})
+                print(f"cycle {n}: {len(delivered)} items in {elapsed:.2f}s (fetch+ingest {fetched - start:.2f}s)", file=sys.stderr)
+        finally:
+            await dispatcher.stop()
+    items = sum(c["items"] for c in cycles)
+    seconds = sum(c["seconds"] for c in cycles)
+    db = "storage/nxt.db"
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "workdir")},
+        "items": items,
+        "seconds": round(seconds, 3),
+        "items_per_sec": round(items / seconds, 2) if seconds else None,
+        "telegram_requests": sum(c["telegram_requests"] for c in cycles),
+        "latency_ms": {"p50": _percentile(latencies, 50), "p99": _percentile(latencies, 99), "max": max(latencies, default=None)},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "db_bytes": sum(os.path.getsize(p) for p in (db, db + "-wal") if os.path.exists(p)),
+        "llm_requests": report["llm_requests"] if cycles else 0,
+        "cycles": cycles,
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cycles", type=int, default=5)
+    ap.add_argument("--rewrite-concurrency", type=int, default=8)
+    ap.add_argument("--rewrite-rate", type=float, default=0, help="OpenRouter requests/sec, 0 = unlimited")
+    ap.add_argument("--send-rate", type=float, default=0, help="Telegram sends/sec, 0 = unlimited")
+    ap.add_argument("--send-chat-rate", type=float, default=0, help="sends/sec per chat, 0 = unlimited")
+    ap.add_argument("--per-host", type=int, default=20)
+    ap.add_argument("--review-mode", choices=("single", "digest"), default="single")
+    ap.add_argument("--no-prefetch", dest="prefetch", action="store_false")
+    ap.add_argument("--workdir", help="keep the scratch directory (database, caches) here")
+    ap.add_argument("--out", help="write the JSON result to this file as well as stdout")
+    stubs.add_arguments(ap)
+    args = ap.parse_args()
+    out = os.path.abspath(args.out) if args.out else None
+
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(target=stubs.serve, args=(port, args), daemon=True)
+    server.start()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="nxt-bench-")
+    os.makedirs(os.path.join(workdir, "storage"), exist_ok=True)
+    os.chdir(workdir)
+    try:
+        _write_sources(base, args.feeds, args.channels)
+        _configure(base, args)
+        asyncio.run(_wait(base))
+        result = asyncio.run(run(args, base))
+    finally:
+        server.terminate()
+        server.join()
+        os.chdir(ROOT)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+# Highlight filtering over a large synthetic feed: legacy per-call regex vs compiled matcher.
+# Usage: python benchmarks/bench_highlights.py [-n 50000] [--per-feed 15]
+import argparse, os, random, re, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fetchers.highlights import HighlightMatcher, EXTRA_PATTERNS, get_matcher
+from fetchers.rss import load_config
+
+WORDS = ("navi faze spirit vitality mouz g2 liquid secret tundra match final group stage inferno mirage "
+         "ancient nuke roshan patch interview roster transfer stream vod recap day грандфинал обзор новости "
+         "турнир состав трансфер интервью").split()
+HOT = "highlight clutch ace 1v3 rampage моменты клатч лучшие trailer deagle".split()
+
+def synthetic(n, hot=0.1, seed=7):
+    # Realistic mix: most entries have no highlight terms at all.
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        title = rnd.choices(WORDS, k=8)
+        if rnd.random() < hot:
+            title[rnd.randrange(8)] = rnd.choice(HOT)
+        out.append({"title": " ".join(title).capitalize(), "summary": " ".join(rnd.choices(WORDS, k=40)),
+                    "url": f"https://example.com/v/{i}"})
+    return out
+
+def legacy_filter(items, keywords):
+    base = [re.escape(k) for k in keywords]
+    patt = re.compile("|".join(base + EXTRA_PATTERNS), re.IGNORECASE)
+    return [it for it in items if patt.search(it.get("title", "")) or patt.search(it.get("summary", ""))]
+
+def timed(fn):
+    t = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - t, out
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", type=int, default=50000)
+    ap.add_argument("--per-feed", type=int, default=15)
+    args = ap.parse_args()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = load_config(os.path.join(root, "sources.yaml"))
+    keywords = config["filters"]["highlight_keywords"]
+    items = synthetic(args.n)
+    feeds = [items[i:i + args.per_feed] for i in range(0, len(items), args.per_feed)]
+
+    re.purge()
+    t_legacy, legacy = timed(lambda: [it for f in feeds for it in legacy_filter(f, keywords)])
+    plain = HighlightMatcher(keywords)
+    t_batch, batch = timed(lambda: plain.filter(items))
+    assert [it["url"] for it in legacy] == [it["url"] for it in batch], "matcher disagrees with legacy filter"
+    t_game, game = timed(lambda: [it for f in feeds for it in get_matcher(config, "cs2").filter(f)])
+    t_rank, ranked = timed(lambda: plain.rank(items))
+
+    print(f"{args.n} entries in {len(feeds)} feeds, {len(legacy)} matches")
+    print(f"legacy per-feed regex: {t_legacy * 1e3:8.1f} ms  ({args.n / t_legacy:,.0f} entries/s)")
+    print(f"matcher batch filter:  {t_batch * 1e3:8.1f} ms  ({args.n / t_batch:,.0f} entries/s, {t_legacy / t_batch:.2f}x)")
+    print(f"per-game + negatives:  {t_game * 1e3:8.1f} ms  ({len(game)} matches)")
+    print(f"rank with scores:      {t_rank * 1e3:8.1f} ms  (top: {ranked[0][1]:.0f} {ranked[0][2][:4]})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Time to healthy: how long after `python bot.py` is spawned /health first answers 200, and how long until
+# /ready does (Telegram initialised, services started). Telegram is the stub from stubs.py; each run starts
+# from the same scratch directory, so after the first run the database already exists, as on a restart.
+# Usage: python benchmarks/bench_startup.py [--runs 5] [--out startup.json]
+import argparse, asyncio, json, multiprocessing, os, shutil, signal, statistics, subprocess, sys, tempfile, time
+import aiohttp
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+import stubs
+from bench_e2e import TOKEN, REVIEW_CHAT_ID, _free_port, _write_sources, _wait
+
+async def _first_ok(session, url: str, deadline: float, step: float) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            async with session.get(url) as r:
+                if r.status == 200:
+                    return time.perf_counter()
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(step)
+    raise RuntimeError(f"{url} did not answer")
+
+async def start_once(base: str, timeout: float) -> dict:
+    port = _free_port()
+    env = dict(os.environ, BOT_TOKEN=TOKEN, REVIEW_CHAT_ID=REVIEW_CHAT_ID, TELEGRAM_API_URL=base, PORT=str(port),
+               KEEPALIVE_ENABLED="false", FETCH_INTERVAL_MIN="600")
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py")], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=1)) as session:
+            deadline = started + timeout
+            healthy = await _first_ok(session, f"http://127.0.0.1:{port}/health", deadline, 0.005)
+            # Coarser while the bot is loading, so the polling itself does not slow the import down.
+            ready = await _first_ok(session, f"http://127.0.0.1:{port}/ready", deadline, 0.02)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    return {"healthy_ms": round((healthy - started) * 1000, 1), "ready_ms": round((ready - started) * 1000, 1)}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--out", help="write the JSON result to this file as well as stdout")
+    stubs.add_arguments(ap)
+    ap.set_defaults(feeds=1, channels=0, size=1)
+    args = ap.parse_args()
+    out = os.path.abspath(args.out) if args.out else None
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(target=stubs.serve, args=(port, args), daemon=True)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="nxt-startup-")
+    os.makedirs(os.path.join(workdir, "storage"), exist_ok=True)
+    os.chdir(workdir)
+    try:
+        _write_sources(base, args.feeds, args.channels)
+        asyncio.run(_wait(base))
+        runs = [asyncio.run(start_once(base, args.timeout)) for _ in range(args.runs)]
+    finally:
+        server.terminate()
+        server.join()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = {"runs": runs}
+    for key in ("healthy_ms", "ready_ms"):
+        values = [r[key] for r in runs]
+        result[key] = {"median": statistics.median(values), "max": max(values)}
+    text = json.dumps(result, indent=2)
+    print(text)
+    if out:
+        with open(out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
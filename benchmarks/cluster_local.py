@@ -0,0 +1,157 @@
+# Several bot processes against one SQLite file, offline (stub feeds, OpenRouter and Bot API from stubs.py).
+# Checks that feeds are split between the nodes without overlap, that exactly one node holds the leader
+# lease, that no item is rewritten or sent twice, and that after the leader is killed another node takes
+# over and the dead node's feeds are polled again.
+# Usage: python benchmarks/cluster_local.py [--nodes 3] [--feeds 12 --channels 3 --size 10] [--keep]
+import argparse, asyncio, glob, json, multiprocessing, os, shutil, signal, sqlite3, subprocess, sys, tempfile, time
+from collections import Counter
+import aiohttp
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+import stubs
+from bench_e2e import TOKEN, REVIEW_CHAT_ID, _free_port, _write_sources, _wait
+
+def _leader(db: str):
+    with sqlite3.connect(db) as conn:
+        row = conn.execute("SELECT holder FROM leases WHERE name = 'leader' AND expires_at > datetime('now')").fetchone()
+    return row and row[0]
+
+def _counts(db: str):
+    # (stored review items, rewritten RSS items)
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT count(*), count(*) FILTER (WHERE source != 'YouTube') FROM items "
+                            "WHERE status != 'duplicate'").fetchone()
+
+def _shards():
+    shards = {}
+    for path in glob.glob("storage/poll_state.*.json"):
+        with open(path, "r", encoding="utf-8") as f:
+            shards[path.split(".")[-2]] = set(json.load(f))
+    return shards
+
+async def _sent(session, base):
+    async with session.get(f"{base}/_bench/sent?since=0") as r:
+        return await r.json()
+
+async def _until(check, timeout: float, step: float = 0.5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = await check()
+        if result:
+            return result
+        await asyncio.sleep(step)
+    return None
+
+def _start(k: int, base: str, args) -> subprocess.Popen:
+    env = dict(os.environ, BOT_TOKEN=TOKEN, REVIEW_CHAT_ID=REVIEW_CHAT_ID, CHANNEL_ID="-1002", ADMIN_USER_ID="1001",
+               TELEGRAM_API_URL=base, OPENROUTER_API_KEY="bench", OPENROUTER_BASE_URL=f"{base}/v1",
+               YOUTUBE_FEED_URL=f"{base}/yt?channel_id={{}}", NXT_ROLE="node", NXT_WORKER_ID=f"w{k}",
+               PORT=str(_free_port()), FETCH_INTERVAL_MIN="1", FEED_MIN_INTERVAL_MIN="0.02", FEED_MAX_INTERVAL_MIN="0.1",
+               REWRITE_RATE_PER_SEC="100", SEND_RATE_PER_SEC="1000", SEND_CHAT_RATE_PER_MIN="60000",
+               KEEPALIVE_ENABLED="false", IMAGE_PREFETCH="false")
+    log = open(f"node{k}.log", "w")
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py")], env=env, stdout=log, stderr=subprocess.STDOUT)
+
+async def run(args, base: str) -> dict:
+    db = "storage/nxt.db"
+    feeds = [f"{base}/rss/{k}" for k in range(args.feeds)] + [f"{base}/yt?channel_id=ch{k}" for k in range(args.channels)]
+    nodes = {f"w{k}": _start(k, base, args) for k in range(args.nodes)}
+    report = {"nodes": args.nodes, "feeds": len(feeds)}
+    try:
+        async with aiohttp.ClientSession() as session:
+            async def settled():
+                # Every feed polled by exactly one node, every RSS entry stored and every stored item delivered.
+                shards = _shards()
+                if len(shards) < len(nodes) or sum(map(len, shards.values())) != len(feeds):
+                    return None
+                stored, rss = _counts(db)
+                sent = await _sent(session, base)
+                delivered = [i for m in sent["sent"] for i in m["item_ids"]]
+                return (shards, sent, delivered) if rss >= args.feeds * args.size and len(set(delivered)) >= stored else None
+
+            started = time.time()
+            result = await _until(settled, args.timeout)
+            if not result:
+                raise RuntimeError("cluster did not settle; see node*.log")
+            shards, sent, delivered = result
+            covered = set().union(*shards.values())
+            report["settle_seconds"] = round(time.time() - started, 1)
+            report["shards"] = {w: len(s) for w, s in sorted(shards.items())}
+            report["shards_disjoint"] = sum(map(len, shards.values())) == len(covered) == len(feeds)
+            report["items"] = len(set(delivered))
+            report["duplicate_sends"] = sum(n - 1 for n in Counter(delivered).values())
+            report["duplicate_rewrites"] = sent["llm_requests"] - _counts(db)[1]
+            leader = _leader(db)
+            report["leader"] = leader
+
+            rss_before = _counts(db)[1]
+            # Fail the leader hard: its lease and heartbeat have to expire before the others notice.
+            nodes[leader].send_signal(signal.SIGKILL)
+            nodes[leader].wait()
+            killed_at = time.time()
+            async with session.post(f"{base}/_bench/advance") as r:
+                report["new_entries"] = (await r.json())["new_entries"]
+
+            async def failed_over():
+                new_leader = _leader(db)
+                return new_leader if new_leader and new_leader != leader else None
+            report["new_leader"] = await _until(failed_over, args.timeout)
+            report["failover_seconds"] = round(time.time() - killed_at, 1)
+
+            async def caught_up():
+                stored, rss = _counts(db)
+                sent = await _sent(session, base)
+                delivered = [i for m in sent["sent"] for i in m["item_ids"]]
+                new_rss = report["new_entries"] * args.feeds // (args.feeds + args.channels)
+                return (sent, delivered) if rss - rss_before >= new_rss and len(set(delivered)) >= stored else None
+            result = await _until(caught_up, args.timeout)
+            sent, delivered = result or (await _sent(session, base), delivered)
+            report["items_after_failover"] = len(set(delivered)) - report["items"]
+            report["duplicate_sends"] = sum(n - 1 for n in Counter(delivered).values())
+            report["duplicate_rewrites"] = sent["llm_requests"] - _counts(db)[1]
+    finally:
+        for p in nodes.values():
+            if p.poll() is None:
+                p.send_signal(signal.SIGTERM)
+        for p in nodes.values():
+            try:
+                p.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                p.kill()
+    report["ok"] = bool(report.get("shards_disjoint") and report.get("new_leader") and report.get("items_after_failover")
+                        and not report.get("duplicate_sends") and not report.get("duplicate_rewrites"))
+    return report
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--nodes", type=int, default=3)
+    ap.add_argument("--timeout", type=float, default=90)
+    ap.add_argument("--keep", action="store_true", help="keep the scratch directory (database, node logs)")
+    stubs.add_arguments(ap)
+    ap.set_defaults(feeds=12, channels=3, size=10, churn=2, llm_latency=0.02)
+    args = ap.parse_args()
+    port = _free_port()
+    base = f"http://127.0.0.1:{port}"
+    server = multiprocessing.Process(target=stubs.serve, args=(port, args), daemon=True)
+    server.start()
+    workdir = tempfile.mkdtemp(prefix="nxt-cluster-")
+    os.makedirs(os.path.join(workdir, "storage"), exist_ok=True)
+    os.chdir(workdir)
+    try:
+        _write_sources(base, args.feeds, args.channels)
+        asyncio.run(_wait(base))
+        report = asyncio.run(run(args, base))
+    finally:
+        server.terminate()
+        server.join()
+        os.chdir(ROOT)
+        if args.keep:
+            print(f"scratch directory: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["ok"] else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# POST recorded Telegram updates to the webhook, the way Telegram would, and report response codes and latency.
+# Usage: python benchmarks/replay_updates.py [files.json ...] [--url http://127.0.0.1:8080/telegram] [-n 100 -c 10]
+# The secret defaults to WEBHOOK_SECRET, or the value the bot derives from BOT_TOKEN.
+import argparse, asyncio, glob, hashlib, json, os, time
+from collections import Counter
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else None
+
+async def replay(url, secret, updates, n, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    codes, latencies = Counter(), []
+
+    async def one(session, i):
+        update = dict(updates[i % len(updates)], update_id=1_000_000 + i)
+        async with sem:
+            t = time.perf_counter()
+            async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as r:
+                await r.read()
+                codes[r.status] += 1
+            latencies.append((time.perf_counter() - t) * 1000)
+
+    async with aiohttp.ClientSession() as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(session, i) for i in range(n)))
+        elapsed = time.perf_counter() - started
+    return {"requests": n, "seconds": round(elapsed, 3), "codes": dict(codes),
+            "latency_ms": {"p50": round(_percentile(latencies, 50), 2), "p99": round(_percentile(latencies, 99), 2)}}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("files", nargs="*", default=sorted(glob.glob(os.path.join(HERE, "updates", "*.json"))))
+    ap.add_argument("--url", default="http://127.0.0.1:%s%s" % (os.getenv("PORT", 8080), os.getenv("WEBHOOK_PATH") or "/telegram"))
+    ap.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET")
+                    or hashlib.sha256(f"webhook:{os.getenv('BOT_TOKEN')}".encode()).hexdigest())
+    ap.add_argument("-n", type=int, default=1, help="total requests (updates are cycled)")
+    ap.add_argument("-c", "--concurrency", type=int, default=10)
+    args = ap.parse_args()
+    updates = []
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as f:
+            updates.append(json.load(f))
+    print(json.dumps(asyncio.run(replay(args.url, args.secret, updates, max(args.n, len(updates)), args.concurrency)), indent=2))
+
+if __name__ == "__main__":
+    main()
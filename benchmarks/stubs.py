@@ -0,0 +1,202 @@
+# Local stand-ins for everything the bot talks to, so a full ingest cycle runs offline:
+#   /rss/<n>, /yt?channel_id=ch<n>   synthetic RSS / YouTube Atom feeds (ETag, 304, per-cycle churn)
+#   /img/<name>                      small image bodies for covers and prefetch
+#   /v1/chat/completions             OpenRouter with configurable latency and 429 rate
+#   /bot<token>/<method>             Telegram Bot API (getMe, sendMessage, sendPhoto, sendMediaGroup, edits, ...)
+#   /_bench/advance, /_bench/sent    control: start the next cycle, read delivered messages
+# Usage: python benchmarks/stubs.py [--port 8800] [--feeds 40 --size 30 --churn 5]
+import argparse, asyncio, hashlib, json, random, time
+from email.utils import formatdate
+from aiohttp import web
+
+VOCAB = [a + b for a in ("ka", "ro", "mi", "zu", "te", "an", "sol", "vex", "dra", "lin", "qua", "bor")
+         for b in ("nix", "tor", "las", "mek", "dan", "rio", "sha", "pul", "ven", "gar", "tox", "lum")]
+BASE_TIME = 1_700_000_000
+IMAGE = b"\xff\xd8\xff\xe0" + bytes(range(256)) * 16
+
+def _words(rnd, n):
+    return " ".join(rnd.choices(VOCAB, k=n))
+
+class FeedStub:
+    # Feed k serves entries [head[k] - size, head[k]) newest first; advance() moves the heads of a
+    # random `changed` fraction of feeds by `churn` entries, so each cycle has a known set of new entries.
+    def __init__(self, feeds=40, channels=10, size=30, churn=5, changed=1.0, hot=0.3, seed=1):
+        self.feeds, self.channels, self.size, self.churn, self.changed, self.hot = feeds, channels, size, churn, changed, hot
+        self.rnd = random.Random(seed)
+        self.heads = {("rss", k): size for k in range(feeds)}
+        self.heads.update({("yt", k): size for k in range(channels)})
+        self.cycle = 0
+
+    def advance(self) -> int:
+        self.cycle += 1
+        new = 0
+        for key in self.heads:
+            if self.rnd.random() < self.changed:
+                self.heads[key] += self.churn
+                new += self.churn
+        return new
+
+    def _entries(self, kind, k, host):
+        head = self.heads[(kind, k)]
+        for i in range(head - 1, max(0, head - self.size) - 1, -1):
+            rnd = random.Random(f"{kind}:{k}:{i}")
+            title = _words(rnd, 9).capitalize()
+            if kind == "yt" and rnd.random() < self.hot:
+                title += " highlights"
+            yield i, title, _words(rnd, 60), f"http://{host}/img/{kind}-{k}-{i}.jpg"
+
+    def rss(self, k, host) -> bytes:
+        parts = [f'<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>Bench {k}</title>'
+                 f'<link>http://{host}/</link><description>bench</description>']
+        for i, title, summary, img in self._entries("rss", k, host):
+            parts.append(f'<item><title>{title}</title><link>http://{host}/a/{k}/{i}</link><guid>bench-{k}-{i}</guid>'
+                         f'<pubDate>{formatdate(BASE_TIME + i * 60, usegmt=True)}</pubDate><description>{summary}</description>'
+                         f'<enclosure url="{img}" type="image/jpeg" length="{len(IMAGE)}"/></item>')
+        parts.append("</channel></rss>")
+        return "".join(parts).encode()
+
+    def youtube(self, k, host) -> bytes:
+        parts = ['<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom" '
+                 'xmlns:yt="http://www.youtube.com/xml/schemas/2015" xmlns:media="http://search.yahoo.com/mrss/">'
+                 f'<title>Channel {k}</title>']
+        for i, title, summary, img in self._entries("yt", k, host):
+            published = time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(BASE_TIME + i * 60))
+            parts.append(f'<entry><id>yt:video:ch{k}v{i}</id><title>{title}</title>'
+                         f'<link rel="alternate" href="http://{host}/watch?v=ch{k}v{i}"/><published>{published}</published>'
+                         f'<media:group><media:title>{title}</media:title><media:description>{summary}</media:description>'
+                         f'<media:thumbnail url="{img}" width="480" height="360"/></media:group></entry>')
+        parts.append("</feed>")
+        return "".join(parts).encode()
+
+class OpenRouterStub:
+    def __init__(self, latency=0.2, jitter=0.5, error_rate=0.0, seed=2):
+        self.latency, self.jitter, self.error_rate = latency, jitter, error_rate
+        self.rnd = random.Random(seed)
+        self.requests = 0
+
+    async def complete(self, request):
+        body = await request.json()
+        self.requests += 1
+        await asyncio.sleep(self.latency * (1 + self.jitter * self.rnd.random()))
+        if self.rnd.random() < self.error_rate:
+            return web.json_response({"error": {"message": "rate limited"}}, status=429, headers={"Retry-After": "1"})
+        text = body["messages"][-1]["content"]
+        return web.json_response({"choices": [{"message": {"role": "assistant", "content": "Кратко: " + text[:200]}}]})
+
+class TelegramStub:
+    # Answers like the Bot API and records every delivered message with its arrival time.
+    def __init__(self, latency=0.0, flood_rate=0.0, seed=3):
+        self.latency, self.flood_rate = latency, flood_rate
+        self.rnd = random.Random(seed)
+        self.sent = []
+        self.polls = 0
+        self.message_id = 0
+
+    async def call(self, request):
+        method = request.match_info["method"]
+        form = await request.post() if request.can_read_body else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"})
+        if method == "getUpdates":
+            await asyncio.sleep(min(1.0, float(form.get("timeout") or 0)))  # an idle long poll
+            self.polls += 1
+            return self._ok([])
+        if method.startswith("send") and self.rnd.random() < self.flood_rate:
+            return web.json_response({"ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                                      "parameters": {"retry_after": 1}}, status=429)
+        if not method.startswith(("send", "edit")):
+            return self._ok(True)
+        chat_id = form.get("chat_id", "0")
+        item_ids = []  # items a review message (or digest index) offers for approval
+        markup = form.get("reply_markup")
+        if markup:
+            for row in json.loads(markup).get("inline_keyboard", []):
+                for button in row:
+                    if button.get("callback_data", "").startswith("approve:"):
+                        item_ids.append(int(button["callback_data"].split(":")[1]))
+        self.sent.append({"t": time.time(), "method": method, "chat_id": chat_id, "item_ids": item_ids})
+        if method == "sendMediaGroup":
+            return self._ok([self._message(chat_id, "sendPhoto", self._photo(form, m["media"]), m.get("caption", ""))
+                             for m in json.loads(form["media"])])
+        return self._ok(self._message(chat_id, method, form.get("photo", ""), form.get("caption") or form.get("text", "")))
+
+    def _photo(self, form, media):
+        # Uploaded files arrive as separate form fields referenced by attach://<name>.
+        return form.get(media[len("attach://"):], media) if media.startswith("attach://") else media
+
+    def _message(self, chat_id, method, photo, text):
+        self.message_id += 1
+        msg = {"message_id": self.message_id, "date": int(time.time()),
+               "chat": {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else 0, "type": "channel"}}
+        if method == "sendPhoto":
+            photo = photo.file.read() if hasattr(photo, "file") else str(photo).encode()
+            file_id = "bench-" + hashlib.sha1(photo).hexdigest()[:16]
+            msg["photo"] = [{"file_id": file_id, "file_unique_id": file_id[:20], "width": 1280, "height": 720}]
+            msg["caption"] = text
+        else:
+            msg["text"] = text
+        return msg
+
+    def _ok(self, result):
+        return web.json_response({"ok": True, "result": result})
+
+def make_app(feeds: FeedStub, llm: OpenRouterStub, telegram: TelegramStub) -> web.Application:
+    async def rss(request):
+        return _feed(request, feeds.rss(int(request.match_info["n"]), request.host), "application/rss+xml")
+
+    async def youtube(request):
+        k = int(request.query.get("channel_id", "ch0")[2:])
+        return _feed(request, feeds.youtube(k, request.host), "application/atom+xml")
+
+    def _feed(request, body, content_type):
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(body=body, content_type=content_type, headers={"ETag": etag})
+
+    async def image(request):
+        return web.Response(body=IMAGE + request.match_info["name"].encode(), content_type="image/jpeg")
+
+    async def advance(request):
+        return web.json_response({"cycle": feeds.cycle + 1, "new_entries": feeds.advance()})
+
+    async def sent(request):
+        since = int(request.query.get("since", 0))
+        return web.json_response({"sent": telegram.sent[since:], "llm_requests": llm.requests, "polls": telegram.polls})
+
+    app = web.Application()
+    app.router.add_get("/rss/{n}", rss)
+    app.router.add_get("/yt", youtube)
+    app.router.add_get("/img/{name}", image)
+    app.router.add_post("/v1/chat/completions", llm.complete)
+    app.router.add_route("*", "/bot{token}/{method}", telegram.call)
+    app.router.add_post("/_bench/advance", advance)
+    app.router.add_get("/_bench/sent", sent)
+    return app
+
+def add_arguments(ap: argparse.ArgumentParser):
+    ap.add_argument("--feeds", type=int, default=40, help="RSS feeds")
+    ap.add_argument("--channels", type=int, default=10, help="YouTube channels")
+    ap.add_argument("--size", type=int, default=30, help="entries per feed")
+    ap.add_argument("--churn", type=int, default=5, help="new entries per changed feed per cycle")
+    ap.add_argument("--changed", type=float, default=1.0, help="fraction of feeds that change per cycle")
+    ap.add_argument("--hot", type=float, default=0.3, help="fraction of videos that pass the highlight filter")
+    ap.add_argument("--llm-latency", type=float, default=0.2)
+    ap.add_argument("--llm-error-rate", type=float, default=0.0)
+    ap.add_argument("--tg-latency", type=float, default=0.0)
+    ap.add_argument("--tg-flood-rate", type=float, default=0.0)
+
+def serve(port: int, args: argparse.Namespace):
+    app = make_app(FeedStub(args.feeds, args.channels, args.size, args.churn, args.changed, args.hot),
+                   OpenRouterStub(args.llm_latency, error_rate=args.llm_error_rate),
+                   TelegramStub(args.tg_latency, args.tg_flood_rate))
+    web.run_app(app, host="127.0.0.1", port=port, print=None, access_log=None)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8800)
+    add_arguments(ap)
+    args = ap.parse_args()
+    serve(args.port, args)
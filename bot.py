@@ -1,45 +1,138 @@
 
-import os, asyncio, logging
+import os, sys, asyncio, hashlib, hmac, html, logging, re, signal, socket
+if __name__ == "__main__":
+    # Run as a script: bind the health server before the imports below, then load this module in the
+    # background and call main() (utils/startup.py). `--profile-startup` prints where startup time goes.
+    from utils.startup import run
+    run("bot")
+    raise SystemExit
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiohttp import web
+from sqlalchemy import select
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler
-from storage.db import init_db, SessionLocal, Item
-from ai.rewrite import rewrite_text
-from fetchers.rss import load_config, parse_rss, youtube_channel_feed, filter_highlights
+from storage.db import (init_db, db_call, db_write, Item, ScheduledPost, new_urls, ingest_items, enqueue_messages, schedule_post,
+                        approved_items, get_items, last_created_at, status_counts, archive_items, prune_outbox, recent_fingerprints, pending_messages,
+                        claim_urls, search_items, search_words)
+from storage.cluster import Cluster
+from utils import metrics
+from utils.health import HealthServer
+from utils.startup import StartupProfile
+from ai.rewrite import RewritePool
+from delivery.outbox import Dispatcher, enqueue, message, notify
+from delivery.scheduler import PostScheduler, wake as wake_scheduler
+from media.imagecache import default_cache
+from fetchers.rss import load_config, fetch_feeds, FeedCache, FEED_CACHE_PATH, youtube_channel_feed
+from fetchers.poller import FeedPoller, POLL_STATE_PATH
+from fetchers.highlights import get_matcher
+from fetchers.neardup import NearDupIndex, minhash, pack, unpack
 
 logging.basicConfig(level=logging.INFO)
 load_dotenv()
-init_db()
 HEALTH_PORT = int(os.getenv("PORT", 8080))
-
-async def health_handler(request):
-    return web.Response(text="OK", status=200)
-
-async def start_health_server():
-    app = web.Application()
-    app.router.add_get("/", health_handler)
-    app.router.add_get("/health", health_handler)
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, host="0.0.0.0", port=HEALTH_PORT)
-    await site.start()
-    logging.info(f"Health server on :{HEALTH_PORT}")
+ITEMS_BY_STATUS = metrics.Gauge("nxt_items", "Items in the hot table by status", ["status"])
+OUTBOX_PENDING = metrics.Gauge("nxt_outbox_pending", "Messages waiting in the outbound queue")
+FETCH_SECONDS = metrics.Histogram("nxt_fetch_cycle_seconds", "Full fetch_to_review cycle time",
+                                  buckets=(1, 5, 10, 30, 60, 120, 300, 600))
+
+ITEM_STATUSES = ("new", "approved", "posted", "skipped", "duplicate")
+
+def _collect_gauges():
+    # Every known status on each scrape: status_counts() leaves out statuses with no rows, which would
+    # otherwise keep their last value.
+    for st, n in (dict.fromkeys(ITEM_STATUSES, 0) | status_counts()).items():
+        ITEMS_BY_STATUS.set(n, st)
+    OUTBOX_PENDING.set(pending_messages())
+
+async def metrics_handler(request):
+    await db_call(_collect_gauges)
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+async def webhook_handler(request):
+    # Telegram webhook ingress: answer at once and leave the update to the application's workers
+    # (concurrent_updates). 503 makes Telegram retry while starting up or when the queue is full.
+    if telegram_app is None:
+        return web.Response(status=503)
+    if not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET):
+        return web.Response(status=403)
+    if telegram_app.update_queue.qsize() >= WEBHOOK_MAX_QUEUE:
+        return web.Response(status=503)
+    try:
+        update = Update.de_json(await request.json(), telegram_app.bot)
+    except (ValueError, TypeError, KeyError):
+        return web.Response(status=400)
+    await telegram_app.update_queue.put(update)
+    return web.Response(status=200)
+
+async def start_health_server(server: HealthServer = None) -> HealthServer:
+    # The server may already be listening (started before this module was imported); add the bot's routes.
+    if server is None:
+        server = HealthServer(HEALTH_PORT)
+        await server.start()
+    server.add("GET", "/metrics", metrics_handler)
+    if WEBHOOK_URL:
+        server.add("POST", WEBHOOK_PATH, webhook_handler)
+    return server
 
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # Bot API base, e.g. a local Bot API server; default api.telegram.org
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public https base URL; empty = long polling
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH") or "/telegram"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS") or 8)
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE") or 1000)
 CHANNEL_ID = os.getenv("CHANNEL_ID")
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID") or 0)
 REVIEW_CHAT_ID = os.getenv("REVIEW_CHAT_ID") or (ADMIN_USER_ID and str(ADMIN_USER_ID)) or None
 FETCH_INTERVAL_MIN = int(os.getenv("FETCH_INTERVAL_MIN") or 90)
-KEEPALIVE_ENABLED = os.getenv("KEEPALIVE_ENABLED", "true").lower() == "true"
+FEED_MIN_INTERVAL_MIN = float(os.getenv("FEED_MIN_INTERVAL_MIN") or 5)
+FEED_MAX_INTERVAL_MIN = float(os.getenv("FEED_MAX_INTERVAL_MIN") or 720)
+KEEPALIVE_ENABLED = os.getenv("KEEPALIVE_ENABLED", "true").lower() == "true" and not WEBHOOK_URL
 KEEPALIVE_INTERVAL_SEC = int(os.getenv("KEEPALIVE_INTERVAL_SEC") or 300)
+FEED_CONCURRENCY = int(os.getenv("FEED_CONCURRENCY") or 20)
+FEED_PER_HOST = int(os.getenv("FEED_PER_HOST") or 4)
+FEED_TIMEOUT_SEC = float(os.getenv("FEED_TIMEOUT_SEC") or 20)
+FEED_MAX_ENTRIES = int(os.getenv("FEED_MAX_ENTRIES") or 50)
+REWRITE_CONCURRENCY = int(os.getenv("REWRITE_CONCURRENCY") or 4)
+REWRITE_RATE_PER_SEC = float(os.getenv("REWRITE_RATE_PER_SEC") or 1)
+IMAGE_PREFETCH = os.getenv("IMAGE_PREFETCH", "true").lower() == "true"
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS") or 0)
+OUTBOX_KEEP_DAYS = int(os.getenv("OUTBOX_KEEP_DAYS") or 7)
+NEAR_DUP_WINDOW_HOURS = int(os.getenv("NEAR_DUP_WINDOW_HOURS") or 48)
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD") or 0.7)
+SEND_RATE_PER_SEC = float(os.getenv("SEND_RATE_PER_SEC") or 20)
+SEND_CHAT_RATE_PER_MIN = float(os.getenv("SEND_CHAT_RATE_PER_MIN") or 20)
+REVIEW_MODE = os.getenv("REVIEW_MODE", "single").lower()  # single: one message per item; digest: albums + index
+DIGEST_SIZE = min(10, max(1, int(os.getenv("DIGEST_SIZE") or 10)))  # a media group holds at most 10 photos
+# standalone: one process does everything; node: shares feeds with the other nodes and may become the leader
+# (Telegram updates, sending, publishing); worker: fetch/rewrite only, never the leader.
+NXT_ROLE = os.getenv("NXT_ROLE", "standalone").lower()
+WORKER_ID = re.sub(r"[^\w.-]", "_", os.getenv("NXT_WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}")
+CLAIM_STALE_SEC = int(os.getenv("CLAIM_STALE_SEC") or 900)
+
+def node_path(path: str) -> str:
+    # Per-node local state next to the shared database: storage/x.json -> storage/x.<worker id>.json
+    if NXT_ROLE == "standalone":
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.{WORKER_ID}{ext}"
 
-config = load_config()
 last_fetch_time = None
+last_fetch_stats = {}
+background_tasks = set()
+near_dups = None
+near_dups_synced = None
+feed_poller = None
+cluster = None
+telegram_app = None  # set once the application is running; the webhook answers 503 before that
+feed_cache = FeedCache(node_path(FEED_CACHE_PATH))
+rewriter = RewritePool(concurrency=REWRITE_CONCURRENCY, rate=REWRITE_RATE_PER_SEC, burst=REWRITE_CONCURRENCY)
 
 def is_admin(user_id: int) -> bool:
     return ADMIN_USER_ID == 0 or user_id == ADMIN_USER_ID
@@ -56,12 +149,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/schedule_at YYYY-MM-DD HH:MM — запланировать следующий одобренный\n"
         "/schedule_text YYYY-MM-DD HH:MM | текст — запланировать кастомный пост\n"
         "/sources — активные источники\n"
-        "/setfreq <минуты> — изменить период (админ)"
+        "/setfreq <минуты> — изменить период (админ)\n"
+        "/archive [дней] — перенести старые posted/skipped/duplicate в архив (админ)\n"
+        "/search <запрос> — поиск по заголовкам, текстам и источникам, включая архив (админ)"
     )
 
 async def sources_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     txt = []
-    for game, data in config.get("games", {}).items():
+    for game, data in load_config().get("games", {}).items():
         txt.append(f"• {game}: RSS={len(data.get('rss', []))}, YT={len(data.get('youtube_channels', []))}")
     await update.message.reply_text("\n".join(txt))
 
@@ -70,16 +165,18 @@ async def setfreq(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     try:
         minutes = int(context.args[0])
+        if minutes <= 0:
+            raise ValueError
     except:
         await update.message.reply_text("Использование: /setfreq 120")
         return
     global FETCH_INTERVAL_MIN
     FETCH_INTERVAL_MIN = minutes
+    if feed_poller:
+        feed_poller.retune(interval=minutes * 60)
     await update.message.reply_text(f"Интервал обновлён: {minutes} мин.")
 
-async def send_for_review(app: Application, item: Item):
-    if not REVIEW_CHAT_ID:
-        return
+def review_message(item: Item) -> dict:
     kb = InlineKeyboardMarkup([
         [
             InlineKeyboardButton("✅ Одобрить", callback_data=f"approve:{item.id}"),
@@ -91,126 +188,253 @@ async def send_for_review(app: Application, item: Item):
         ]
     ])
     if item.image_url:
-        await app.bot.send_photo(chat_id=REVIEW_CHAT_ID, photo=item.image_url, caption=fmt(item), parse_mode=ParseMode.HTML, reply_markup=kb)
-    else:
-        await app.bot.send_message(chat_id=REVIEW_CHAT_ID, text=fmt(item), parse_mode=ParseMode.HTML, reply_markup=kb, disable_web_page_preview=False)
-
-async def _send_to_channel(app: Application, item: Item):
+        return message(REVIEW_CHAT_ID, "send_photo", item.id, photo=item.image_url, caption=fmt(item), parse_mode=ParseMode.HTML, reply_markup=kb)
+    return message(REVIEW_CHAT_ID, "send_message", item.id, text=fmt(item), parse_mode=ParseMode.HTML, reply_markup=kb, disable_web_page_preview=False)
+
+DIGEST_MARKS = {"approved": "✅", "skipped": "⏭️", "posted": "🆗", "duplicate": "♻️"}
+
+def digest_index(items) -> tuple:
+    # Numbered titles with one row of buttons per undecided item; decided items keep a one-button status
+    # row, so the keyboard always lists every item of the digest and the index can be rebuilt from it.
+    lines, rows = [], []
+    for n, it in enumerate(items, 1):
+        mark = DIGEST_MARKS.get(it.status, "")
+        if it.status == "approved" and it.scheduled_at:
+            mark = "📆"
+        lines.append(f"{n}. {mark + ' ' if mark else ''}<b>{html.escape(it.title)}</b> — {html.escape(it.source or '')}")
+        if mark:
+            rows.append([InlineKeyboardButton(f"{n}: {mark} {it.status}", callback_data=f"noop:{it.id}:d")])
+        else:
+            rows.append([InlineKeyboardButton(f"✅ {n}", callback_data=f"approve:{it.id}:d"),
+                         InlineKeyboardButton(f"⏭️ {n}", callback_data=f"skip:{it.id}:d"),
+                         InlineKeyboardButton(f"🆗 {n}", callback_data=f"postnow:{it.id}:d"),
+                         InlineKeyboardButton(f"📆 {n}", callback_data=f"plan60:{it.id}:d")])
+    return "\n".join(lines), InlineKeyboardMarkup(rows)
+
+def digest_messages(items) -> list:
+    # Up to DIGEST_SIZE items: their photos as one album (captions carry the index numbers), then the index.
+    photos = [(n, it) for n, it in enumerate(items, 1) if it.image_url]
+    msgs = []
+    if len(photos) > 1:
+        media = [{"photo": it.image_url, "caption": f"{n}. {it.title}"[:1024]} for n, it in photos]
+        msgs.append(message(REVIEW_CHAT_ID, "send_media_group", media=media))
+    elif photos:
+        n, it = photos[0]
+        msgs.append(message(REVIEW_CHAT_ID, "send_photo", photo=it.image_url, caption=f"{n}. {it.title}"[:1024]))
+    text, kb = digest_index(items)
+    msgs.append(message(REVIEW_CHAT_ID, "send_message", text=text, parse_mode=ParseMode.HTML, reply_markup=kb,
+                        disable_web_page_preview=True))
+    return msgs
+
+def channel_message(item: Item) -> dict:
     text = f"📰 <b>{item.title}</b>\n{item.summary}\n\nИсточник: {item.source}\n#nxtesports #киберспорт"
     if item.image_url:
-        await app.bot.send_photo(chat_id=CHANNEL_ID, photo=item.image_url, caption=text, parse_mode=ParseMode.HTML)
-    else:
-        await app.bot.send_message(chat_id=CHANNEL_ID, text=text, parse_mode=ParseMode.HTML)
+        return message(CHANNEL_ID, "send_photo", item.id, photo=item.image_url, caption=text, parse_mode=ParseMode.HTML)
+    return message(CHANNEL_ID, "send_message", item.id, text=text, parse_mode=ParseMode.HTML)
+
+def review_messages(items: list) -> list:
+    if not REVIEW_CHAT_ID:
+        return []
+    if REVIEW_MODE == "digest":
+        return [m for i in range(0, len(items), DIGEST_SIZE) for m in digest_messages(items[i:i + DIGEST_SIZE])]
+    return [review_message(it) for it in items]
+
+def queue_for_review(items: list, session):
+    # Runs in the ingest transaction: an item is never stored without its review message, which would leave it
+    # `new` but already seen, so never offered again. The outbox dispatcher delivers with rate limiting and retries.
+    enqueue_messages(review_messages([it for it in items if it.status != "duplicate"]), session=session)
 
 async def cb_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # One edit per press: the new text (or caption) and the keyboard go in the same call.
     query = update.callback_query
     await query.answer()
-    data = query.data
-    action, sid = data.split(":")
-    session = SessionLocal()
-    item = session.get(Item, int(sid))
+    action, sid, *rest = query.data.split(":")
+    if action not in ("approve", "skip", "postnow", "plan60"):
+        return
+    item = await db_write(review_action, int(sid), action)
+    if action == "postnow":
+        notify()
+    elif action == "plan60":
+        wake_scheduler()
+    if rest == ["d"]:
+        ids = [int(row[0].callback_data.split(":")[1]) for row in query.message.reply_markup.inline_keyboard]
+        text, kb = digest_index(await db_call(get_items, ids))
+        await query.edit_message_text(text or "Элементы не найдены.", parse_mode=ParseMode.HTML, reply_markup=kb, disable_web_page_preview=True)
+        return
     if not item:
         await query.edit_message_text("Элемент не найден.")
-        session.close()
         return
+    done = InlineKeyboardMarkup([])
+    if item.image_url:
+        await query.edit_message_caption(caption=fmt(item), parse_mode=ParseMode.HTML, reply_markup=done)
+    else:
+        await query.edit_message_text(fmt(item), parse_mode=ParseMode.HTML, reply_markup=done)
+
+def review_action(item_id: int, action: str, session) -> Item:
+    # Runs on the DB writer: the status change and anything it queues commit together.
+    item = session.get(Item, item_id)
+    if not item:
+        return None
     if action == "approve":
         item.status = "approved"
-        session.commit()
-        await query.edit_message_reply_markup(None)
-        await query.edit_message_caption(caption=fmt(item), parse_mode=ParseMode.HTML) if item.image_url else await query.edit_message_text(fmt(item), parse_mode=ParseMode.HTML)
     elif action == "skip":
         item.status = "skipped"
-        session.commit()
-        await query.edit_message_reply_markup(None)
-        await query.edit_message_caption(caption=fmt(item), parse_mode=ParseMode.HTML) if item.image_url else await query.edit_message_text(fmt(item), parse_mode=ParseMode.HTML)
     elif action == "postnow":
-        await _send_to_channel(context.application, item)
+        enqueue_messages([channel_message(item)], session=session)
         item.status = "posted"
-        session.commit()
-        await query.edit_message_reply_markup(None)
-        await query.edit_message_caption(caption=fmt(item), parse_mode=ParseMode.HTML) if item.image_url else await query.edit_message_text(fmt(item), parse_mode=ParseMode.HTML)
     elif action == "plan60":
         run_time = datetime.utcnow() + timedelta(minutes=60)
         item.scheduled_at = run_time
         item.status = "approved"
-        session.commit()
-        context.job_queue.run_once(callback=scheduled_post_job, when=run_time, data={"item_id": item.id})
-        await query.edit_message_reply_markup(None)
-        await query.edit_message_caption(caption=fmt(item), parse_mode=ParseMode.HTML) if item.image_url else await query.edit_message_text(fmt(item), parse_mode=ParseMode.HTML)
-    session.close()
-
-async def scheduled_post_job(ctx):
-    app = ctx.application
-    data = ctx.job.data or {}
-    item_id = data.get("item_id")
-    session = SessionLocal()
-    item = session.get(Item, item_id)
-    if item and item.status in ("approved", "new"):
-        await _send_to_channel(app, item)
-        item.status = "posted"
-        session.commit()
-    session.close()
+        schedule_post(run_time, item_id=item.id, session=session)
+    return item
 
-async def fetch_to_review(app: Application):
+def post_next_approved(session) -> Item:
+    item = session.scalars(select(Item).where(Item.status == "approved").order_by(Item.id).limit(1)).first()
+    if item:
+        enqueue_messages([channel_message(item)], session=session)
+        item.status = "posted"
+    return item
+
+def schedule_next_approved(when: datetime, session) -> Item:
+    item = session.scalars(select(Item).where(Item.status == "approved").order_by(Item.id).limit(1)).first()
+    if item:
+        item.scheduled_at = when
+        schedule_post(when, item_id=item.id, session=session)
+    return item
+
+def publish_scheduled(post_id: int, session) -> bool:
+    # Runs on the DB writer; the post, its item and the outbound message change in one transaction.
+    post = session.get(ScheduledPost, post_id)
+    if not post or post.status != "pending":
+        return False
+    if post.kind == "text":
+        msgs = [message(CHANNEL_ID, "send_message", text=post.text, parse_mode=ParseMode.HTML)]
+    else:
+        item = session.get(Item, post.item_id)
+        if not item or item.status not in ("approved", "new"):
+            post.status = "cancelled"
+            return False
+        msgs = [channel_message(item)]
+        item.status = "posted"
+    post.status = "done"
+    enqueue_messages(msgs, session=session)
+    return True
+
+def near_dup_index() -> NearDupIndex:
+    # Built on first use and warmed from fingerprints stored within the window, so it survives restarts.
+    global near_dups
+    if near_dups is None:
+        near_dups = NearDupIndex(timedelta(hours=NEAR_DUP_WINDOW_HOURS), NEAR_DUP_THRESHOLD)
+        since = datetime.utcnow() - near_dups.window
+        near_dups.warm((url, unpack(fp), ts) for url, fp, ts in recent_fingerprints(since))
+    return near_dups
+
+def mark_near_duplicates(rows: list) -> int:
+    # Fingerprint new rows and cluster near-duplicates (across sources and within the batch) onto
+    # the first item seen; duplicates are stored but never rewritten or sent for review.
+    global near_dups_synced
+    index = near_dup_index()
+    if cluster:
+        # Pick up what the other workers stored since the last cycle (with an overlap for items that were
+        # still being rewritten); adding a known url is a no-op.
+        now = datetime.utcnow()
+        since = (near_dups_synced or now) - timedelta(seconds=CLAIM_STALE_SEC)
+        index.warm((url, unpack(fp), ts) for url, fp, ts in recent_fingerprints(since))
+        near_dups_synced = now
+    index.prune()
+    dups = 0
+    for r in rows:
+        sig = minhash(r.pop("fp_text"))
+        r["fingerprint"], r["duplicate_of"] = None, None
+        if sig is None:
+            continue
+        r["fingerprint"] = pack(sig)
+        original = index.find(sig, exclude=r["url"])
+        if original:
+            r["status"], r["duplicate_of"], r["rewrite"] = "duplicate", original, False
+            dups += 1
+        else:
+            index.add(r["url"], sig)
+    return dups
+
+def feed_urls(config: dict) -> list:
+    games = config.get("games", {})
+    urls = [u for data in games.values() for u in data.get("rss", [])]
+    return urls + [youtube_channel_feed(ch) for data in games.values() for ch in data.get("youtube_channels", [])]
+
+async def fetch_to_review(app: Application, urls: list = None):
+    # urls=None fetches every feed and reports an empty run; the poller passes the feeds that are due.
+    # Returns ({url: new entries}, failed urls).
+    with FETCH_SECONDS.time():
+        return await _fetch_to_review(app, urls)
+
+async def _fetch_to_review(app: Application, only: list = None):
+    global last_fetch_time, last_fetch_stats
     config = load_config()
-last_fetch_time = None
-    session = SessionLocal()
-    added = 0
-    try:
-        for game, data in config.get("games", {}).items():
-            for url in data.get("rss", []):
-                for it in parse_rss(url):
-                    title = it["title"].strip()
-                    url_ = it["url"].strip()
-                    summary = it["summary"].strip()
-                    image_url = it.get("image_url")
-                    source = url.split('/')[2]
-                    exists = session.query(Item).filter_by(url=url_).first()
-                    if exists:
-                        continue
-                    rewritten = rewrite_text(f"{title}\n\n{summary}\n\nКратко перескажи для киберспортивного канала NXT Esports.")
-                    item = Item(url=url_, title=title, summary=rewritten, source=source, image_url=image_url, status="new")
-                    session.add(item); session.commit()
-                    await send_for_review(app, item)
-                    added += 1
-            for ch in data.get("youtube_channels", []):
-                items = parse_rss(youtube_channel_feed(ch))
-                items = filter_highlights(items, config.get("filters", {}).get("highlight_keywords", []))
-                for it in items:
-                    title = it["title"].strip()
-                    url_ = it["url"].strip()
-                    image_url = it.get("image_url")
-                    summary = f"🎥 Хайлайты: {title}\nСмотри видео: {url_}"
-                    source = "YouTube"
-                    exists = session.query(Item).filter_by(url=url_).first()
-                    if exists:
-                        continue
-                    item = Item(url=url_, title=title, summary=summary, source=source, image_url=image_url, status="new")
-                    session.add(item); session.commit()
-                    await send_for_review(app, item)
-                    added += 1
-        logging.info("Fetched %s new items for review", added)
-        global last_fetch_time
-        last_fetch_time = dt.datetime.utcnow() if 'dt' in globals() else __import__('datetime').datetime.utcnow()
-        if added == 0 and (REVIEW_CHAT_ID):
-            try:
-                await app.bot.send_message(chat_id=REVIEW_CHAT_ID, text="🔎 Новых материалов нет. Я всё проверил.")
-            except Exception:
-                pass
-    finally:
-        session.close()
+    games = config.get("games", {})
+    urls = feed_urls(config)
+    if only is not None:
+        wanted = set(only)
+        urls = [u for u in urls if u in wanted]
+    feeds, last_fetch_stats = await fetch_feeds(urls, limit=FEED_CONCURRENCY, per_host=FEED_PER_HOST,
+                                                timeout=FEED_TIMEOUT_SEC, cache=feed_cache, max_entries=FEED_MAX_ENTRIES)
+    logging.info("Feeds: %(fetched)s changed, %(unchanged)s unchanged, %(failed)s failed, %(bytes)s bytes", last_fetch_stats)
+    candidates = []
+    for game, data in games.items():
+        for url in data.get("rss", []):
+            for it in feeds.get(url, []):
+                title, summary = it["title"].strip(), it["summary"].strip()
+                candidates.append({"url": it["url"].strip(), "title": title, "summary": summary, "fp_text": f"{title}\n{summary}",
+                                   "source": url.split('/')[2], "image_url": it.get("image_url"), "rewrite": True})
+        matcher = get_matcher(config, game)
+        for ch in data.get("youtube_channels", []):
+            items = matcher.filter(feeds.get(youtube_channel_feed(ch), []))
+            for it in items:
+                title, url_ = it["title"].strip(), it["url"].strip()
+                candidates.append({"url": url_, "title": title, "summary": f"🎥 Хайлайты: {title}\nСмотри видео: {url_}",
+                                   "fp_text": f"{title}\n{it['summary']}", "source": "YouTube",
+                                   "image_url": it.get("image_url"), "rewrite": False})
+    fresh = await db_call(new_urls, [c["url"] for c in candidates])
+    if cluster:
+        # Another worker may have fetched the same entry (a shared URL, or a feed that just moved).
+        fresh = await db_call(claim_urls, fresh, WORKER_ID, CLAIM_STALE_SEC)
+    fresh = set(fresh)
+    rows = []
+    for c in candidates:
+        if c["url"] not in fresh:
+            continue
+        fresh.discard(c["url"])
+        rows.append(dict(c, status="new"))
+    dups = await db_call(mark_near_duplicates, rows)
+    to_rewrite = [r for r in rows if r.pop("rewrite")]
+    summaries = await rewriter.rewrite_many([f"{r['title']}\n\n{r['summary']}\n\nКратко перескажи для киберспортивного канала NXT Esports." for r in to_rewrite])
+    for r, summary in zip(to_rewrite, summaries):
+        r["summary"] = summary
+    items = [it for it in await db_call(ingest_items, rows, on_insert=queue_for_review) if it.status != "duplicate"]
+    notify()
+    feed_cache.save()
+    if IMAGE_PREFETCH and items:
+        # Warm the image cache for covers without holding up review delivery.
+        task = asyncio.create_task(default_cache().prefetch(it.image_url for it in items))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    added = len(items)
+    logging.info("Fetched %s new items for review, %s near-duplicates held back", added, dups)
+    last_fetch_time = datetime.utcnow()
+    if added == 0 and only is None and REVIEW_CHAT_ID:
+        await enqueue([message(REVIEW_CHAT_ID, "send_message", text="🔎 Новых материалов нет. Я всё проверил.")])
+    return feeds, set(last_fetch_stats["failed_urls"])
 
 async def postnow_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Собираю свежие материалы и кидаю в редакторский чат…")
-    await fetch_to_review(context.application)
+    await (feed_poller.poll_now() if feed_poller else fetch_to_review(context.application))
     await update.message.reply_text("Готово! Проверь редакторский чат.")
 
 async def queue_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
         return
-    session = SessionLocal()
-    items = session.query(Item).filter(Item.status=="approved").order_by(Item.id.asc()).limit(10).all()
-    session.close()
+    items = await db_call(approved_items, 10)
     if not items:
         await update.message.reply_text("Одобренных постов нет.")
         return
@@ -218,15 +442,11 @@ async def queue_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(txt, parse_mode=ParseMode.HTML)
 
 async def postapproved_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
-    item = session.query(Item).filter(Item.status=="approved").order_by(Item.id.asc()).first()
+    item = await db_write(post_next_approved)
     if not item:
         await update.message.reply_text("Нет одобренных постов.")
-        session.close()
         return
-    await _send_to_channel(context.application, item)
-    item.status = "posted"
-    session.commit(); session.close()
+    notify()
     await update.message.reply_text("Опубликовано.")
 
 def parse_dt_arg(arg1: str, arg2: str) -> datetime:
@@ -237,15 +457,11 @@ async def schedule_at_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Использование: /schedule_at 2025-08-12 14:30")
         return
     when = parse_dt_arg(context.args[0], context.args[1])
-    session = SessionLocal()
-    item = session.query(Item).filter(Item.status=="approved").order_by(Item.id.asc()).first()
+    item = await db_write(schedule_next_approved, when)
     if not item:
         await update.message.reply_text("Нет одобренных постов.")
-        session.close()
         return
-    item.scheduled_at = when
-    session.commit(); session.close()
-    context.job_queue.run_once(callback=scheduled_post_job, when=when, data={"item_id": item.id})
+    wake_scheduler()
     await update.message.reply_text(f"Запланировал на {when}.")
 
 async def schedule_text_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -260,68 +476,226 @@ async def schedule_text_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Неверный формат даты. Пример: 2025-08-12 14:30")
         return
     when = parse_dt_arg(parts[0], parts[1])
-    async def post_custom(ctx):
-        await ctx.application.bot.send_message(chat_id=CHANNEL_ID, text=text.strip(), parse_mode=ParseMode.HTML)
-    context.job_queue.run_once(callback=post_custom, when=when)
+    await db_write(schedule_post, when, text=text.strip())
+    wake_scheduler()
     await update.message.reply_text(f"Запланировал кастомный пост на {when}.")
 
-async def scheduler_job(app: Application):
-    await fetch_to_review(app)
-
 
 
 async def status_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    session = SessionLocal()
-    try:
-        total = session.query(Item).count()
-        counts = {}
-        for st in (\"new\",\"approved\",\"posted\",\"skipped\"):
-            counts[st] = session.query(Item).filter(Item.status==st).count()
-        from datetime import datetime as _dt
-        last = session.query(Item).order_by(Item.created_at.desc()).first()
-        last_created = last.created_at.isoformat(sep=' ') if last else '—'
-    finally:
-        session.close()
+    counts = await db_call(status_counts)
+    total = sum(counts.values())
+    last = await db_call(last_created_at)
+    last_created = last.isoformat(sep=' ') if last else '—'
+    poll_line = ""
+    if feed_poller and feed_poller.intervals:
+        ivs = feed_poller.intervals.values()
+        poll_line = f" (по фидам: {min(ivs) / 60:.0f}–{max(ivs) / 60:.0f} мин.)"
     lf = (last_fetch_time.isoformat(sep=' ') if 'last_fetch_time' in globals() and last_fetch_time else '—')
     await update.message.reply_text(
-        f\"\"\"Статус бота:
+        f"""Статус бота:
 Последний сбор: {lf}
+Фиды (изменились / без изменений / ошибки): {last_fetch_stats.get('fetched',0)} / {last_fetch_stats.get('unchanged',0)} / {last_fetch_stats.get('failed',0)}
 Всего материалов в базе: {total}
 new / approved / posted / skipped: {counts.get('new',0)} / {counts.get('approved',0)} / {counts.get('posted',0)} / {counts.get('skipped',0)}
-Интервал парсинга: {FETCH_INTERVAL_MIN} мин.
+Отсеяно дублей: {counts.get('duplicate',0)}
+Интервал парсинга: {FETCH_INTERVAL_MIN} мин. в среднем{poll_line}
 KeepAlive: {'включен' if KEEPALIVE_ENABLED else 'выключен'} ({KEEPALIVE_INTERVAL_SEC} сек)
 Последний добавленный материал: {last_created}
-\"\"\".strip())
+""".strip())
+
+async def archive_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    try:
+        days = int(context.args[0]) if context.args else (ARCHIVE_AFTER_DAYS or 30)
+    except ValueError:
+        await update.message.reply_text("Использование: /archive 30")
+        return
+    moved = await db_call(archive_items, timedelta(days=days))
+    await update.message.reply_text(f"В архив перенесено: {moved} (posted/skipped/duplicate старше {days} дн.)")
+
+SEARCH_PAGE_SIZE = 5
+SEARCH_SNIPPET_WORDS = 16
+
+def search_snippet(summary: str, words: list) -> str:
+    # A few words of the summary around the first match, matches in bold.
+    toks = (summary or "").split()
+    hit = lambda t: any(re.sub(r"\W", "", t.lower()).startswith(w) for w in words)
+    first = next((i for i, t in enumerate(toks) if hit(t)), 0)
+    start = max(first - 3, 0)
+    part = [f"<b>{html.escape(t)}</b>" if hit(t) else html.escape(t) for t in toks[start:start + SEARCH_SNIPPET_WORDS]]
+    return ("…" if start else "") + " ".join(part) + ("…" if start + SEARCH_SNIPPET_WORDS < len(toks) else "")
+
+def search_results(q: str, items: list, page: int) -> tuple:
+    # `items` is up to SEARCH_PAGE_SIZE + 1 results from this page on; the extra one only tells that a next
+    # page exists. The first line is the query itself, the page buttons read it back from the message.
+    words = search_words(q)
+    lines = [f"🔎 {html.escape(q)}"]
+    for n, it in enumerate(items[:SEARCH_PAGE_SIZE], page * SEARCH_PAGE_SIZE + 1):
+        mark = DIGEST_MARKS.get(it.status, it.status)
+        when = it.created_at.strftime("%Y-%m-%d") if it.created_at else ""
+        lines.append(f"\n{n}. {mark} <b>{html.escape(it.title)}</b> · {when}\n{search_snippet(it.summary, words)}\n"
+                     f'<a href="{html.escape(it.url)}">{html.escape(it.source or "ссылка")}</a>')
+    if not items:
+        lines.append("Ничего не найдено.")
+    nav = []
+    if page:
+        nav.append(InlineKeyboardButton("◀️", callback_data=f"search:{page - 1}"))
+    if len(items) > SEARCH_PAGE_SIZE:
+        nav.append(InlineKeyboardButton("▶️", callback_data=f"search:{page + 1}"))
+    return "\n".join(lines), InlineKeyboardMarkup([nav] if nav else [])
+
+async def search_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update.effective_user.id):
+        return
+    q = " ".join(context.args)
+    if not q:
+        await update.message.reply_text("Использование: /search navi major")
+        return
+    items = await db_call(search_items, q, SEARCH_PAGE_SIZE + 1, 0)
+    text, kb = search_results(q, items, 0)
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=kb, disable_web_page_preview=True)
+
+async def search_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(update.effective_user.id):
+        return
+    page = max(int(query.data.split(":")[1]), 0)
+    q = query.message.text.split("\n", 1)[0].removeprefix("🔎 ")
+    items = await db_call(search_items, q, SEARCH_PAGE_SIZE + 1, page * SEARCH_PAGE_SIZE)
+    text, kb = search_results(q, items, page)
+    await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=kb, disable_web_page_preview=True)
+
+async def archive_job():
+    moved = await db_call(archive_items, timedelta(days=ARCHIVE_AFTER_DAYS))
+    logging.info("Archived %s items", moved)
+
+async def outbox_prune_job():
+    removed = await db_call(prune_outbox, timedelta(days=OUTBOX_KEEP_DAYS))
+    logging.info("Pruned %s sent/failed outbox messages", removed)
 
 async def keepalive_job(app: Application):
     try:
         await app.bot.get_me()
-        logging.debug(\"keepalive ping ok\")
+        logging.debug("keepalive ping ok")
     except Exception as e:
-        logging.warning(\"keepalive ping failed: %s\", e)
-
-async def main():
-    await start_health_server()
-    app = Application.builder().token(BOT_TOKEN).build()
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("sources", sources_cmd))
-    app.add_handler(CommandHandler("postnow", postnow_cmd))
-    app.add_handler(CommandHandler("queue", queue_cmd))
-    app.add_handler(CommandHandler("postapproved", postapproved_cmd))
-    app.add_handler(CommandHandler("schedule_at", schedule_at_cmd))
-    app.add_handler(CommandHandler("schedule_text", schedule_text_cmd))
-    app.add_handler(CommandHandler("setfreq", setfreq))
-    app.add_handler(CallbackQueryHandler(cb_handler))
-    app.add_handler(CommandHandler("status", status_cmd))
+        logging.warning("keepalive ping failed: %s", e)
+
+async def start_webhook(app: Application) -> bool:
+    try:
+        await app.bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                                  allowed_updates=Update.ALL_TYPES, max_connections=WEBHOOK_WORKERS)
+    except TelegramError as e:
+        logging.error("setWebhook failed, falling back to polling: %r", e)
+        return False
+    logging.info("Webhook set: %s%s", WEBHOOK_URL.rstrip("/"), WEBHOOK_PATH)
+    return True
+
+def leader_only(job):
+    # Scheduler jobs that must run on one node only.
+    async def run(*args):
+        if cluster is None or cluster.leader:
+            await job(*args)
+    return run
+
+async def main(server: HealthServer = None, profile: StartupProfile = None):
+    # server: a health server already listening (see utils/startup.py); profile: startup timings.
+    global feed_poller, telegram_app, cluster
+    profile = profile or StartupProfile()
+    with profile.phase("health routes"):
+        server = await start_health_server(server)
+    with profile.phase("init_db"):
+        await asyncio.to_thread(init_db)
+    with profile.phase("build application"):
+        builder = Application.builder().token(BOT_TOKEN).concurrent_updates(WEBHOOK_WORKERS)
+        if TELEGRAM_API_URL:
+            builder = builder.base_url(TELEGRAM_API_URL.rstrip("/") + "/bot")
+        app = builder.build()
+        app.add_handler(CommandHandler("start", start))
+        app.add_handler(CommandHandler("sources", sources_cmd))
+        app.add_handler(CommandHandler("postnow", postnow_cmd))
+        app.add_handler(CommandHandler("queue", queue_cmd))
+        app.add_handler(CommandHandler("postapproved", postapproved_cmd))
+        app.add_handler(CommandHandler("schedule_at", schedule_at_cmd))
+        app.add_handler(CommandHandler("schedule_text", schedule_text_cmd))
+        app.add_handler(CommandHandler("setfreq", setfreq))
+        app.add_handler(CallbackQueryHandler(search_cb, pattern=r"^search:\d+$"))
+        app.add_handler(CallbackQueryHandler(cb_handler))
+        app.add_handler(CommandHandler("status", status_cmd))
+        app.add_handler(CommandHandler("archive", archive_cmd))
+        app.add_handler(CommandHandler("search", search_cmd))
 
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(lambda: asyncio.create_task(scheduler_job(app)), "interval", minutes=FETCH_INTERVAL_MIN)
     if KEEPALIVE_ENABLED:
-        scheduler.add_job(lambda: asyncio.create_task(keepalive_job(app)), "interval", seconds=KEEPALIVE_INTERVAL_SEC)
+        scheduler.add_job(lambda: asyncio.create_task(leader_only(keepalive_job)(app)), "interval", seconds=KEEPALIVE_INTERVAL_SEC)
+    if ARCHIVE_AFTER_DAYS > 0:
+        scheduler.add_job(lambda: asyncio.create_task(leader_only(archive_job)()), "interval", hours=24)
+    if OUTBOX_KEEP_DAYS > 0:
+        scheduler.add_job(lambda: asyncio.create_task(leader_only(outbox_prune_job)()), "interval", hours=24)
     scheduler.start()
 
-    print("Bot is running (editor mode, media enabled). Ctrl+C to stop.")
-    await app.run_polling()
-
-if __name__ == "__main__":
-    asyncio.run(main())
+    dispatcher = Dispatcher(app.bot, rate=SEND_RATE_PER_SEC, per_chat_rate=SEND_CHAT_RATE_PER_MIN / 60)
+    post_scheduler = PostScheduler(publish_scheduled)
+    feed_poller = FeedPoller(lambda: [u for u in feed_urls(load_config()) if cluster is None or cluster.owns(u)],
+                             lambda urls: fetch_to_review(app, urls),
+                             interval=FETCH_INTERVAL_MIN * 60, min_interval=FEED_MIN_INTERVAL_MIN * 60,
+                             max_interval=FEED_MAX_INTERVAL_MIN * 60, path=node_path(POLL_STATE_PATH))
+
+    async def lead():
+        # Leader duties: receive Telegram updates (getUpdates allows one consumer per bot), send and publish.
+        if not (WEBHOOK_URL and await start_webhook(app)):
+            await app.updater.start_polling()
+        dispatcher.start()
+        post_scheduler.start()
+
+    async def step_down():
+        await post_scheduler.stop()
+        await dispatcher.stop()
+        if app.updater.running:
+            await app.updater.stop()
+
+    def tick():
+        # Messages queued and posts scheduled by the other nodes.
+        notify()
+        wake_scheduler()
+
+    if NXT_ROLE != "standalone":
+        cluster = Cluster(WORKER_ID, lead=NXT_ROLE == "node", on_elected=lead, on_demoted=step_down,
+                          on_members=feed_poller.wake, on_tick=tick)
+    stopped = asyncio.Event()
+    # systemd stops with SIGTERM: shut down cleanly so the lease and the feeds move at once.
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+    try:
+        if NXT_ROLE != "worker":
+            with profile.phase("telegram initialize"):
+                await app.initialize()
+            with profile.phase("telegram start"):
+                await app.start()
+            telegram_app = app  # webhook updates are handled on any node
+        with profile.phase("start services"):
+            if cluster:
+                cluster.start()
+            else:
+                await lead()
+            feed_poller.start()
+        server.ready = True
+        profile.ready()
+        print(f"Bot is running (editor mode, media enabled, role {NXT_ROLE}). Ctrl+C to stop.")
+        if profile.enabled:
+            print(profile.report(), file=sys.stderr)
+            stopped.set()
+        await stopped.wait()
+    finally:
+        server.ready = False
+        await feed_poller.stop()
+        if cluster:
+            await cluster.stop()
+        else:
+            await step_down()
+        telegram_app = None
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        await server.stop()
@@ -0,0 +1,158 @@
+import asyncio, json, logging, random
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Tuple
+from telegram import Bot, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest, Forbidden, InvalidToken, RetryAfter
+from storage.db import Outbox, db_call, db_write, enqueue_messages, due_messages, next_message_due, mark_message, put_file_id
+from media import fileids
+from utils.metrics import Counter, Histogram
+from utils.ratelimit import TokenBucket
+
+MAX_ATTEMPTS = 8
+IDLE_POLL_SEC = 30
+_dispatchers = []
+SEND_SECONDS = Histogram("nxt_telegram_send_seconds", "Telegram API call time", ["method"])
+SEND_RESULTS = Counter("nxt_telegram_sends_total", "Outbox send attempts by result", ["method", "result"])
+
+def notify():
+    for d in _dispatchers:
+        d.wake()
+
+async def enqueue(messages: List[Dict]) -> int:
+    # Persist outbound messages and wake the running dispatcher; delivery happens in the background.
+    n = await db_write(enqueue_messages, messages)
+    notify()
+    return n
+
+def message(chat_id, method: str, item_id: int = None, **kwargs) -> Dict:
+    if isinstance(kwargs.get("reply_markup"), InlineKeyboardMarkup):
+        kwargs["reply_markup"] = kwargs["reply_markup"].to_dict()
+    return {"chat_id": chat_id, "method": method, "payload": kwargs, "item_id": item_id}
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+class Dispatcher:
+    # Drains the outbox table with a global and a per-chat rate limit.
+    # Chats are served concurrently, messages within a chat stay in order.
+    def __init__(self, bot: Bot, *, rate: float = 20, per_chat_rate: float = 1 / 3, per_chat_burst: int = 3,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, max(1, int(rate)))
+        self.chat_buckets = defaultdict(lambda: TokenBucket(per_chat_rate, per_chat_burst))
+        self.photo_locks: Dict[str, asyncio.Lock] = {}
+        self.max_attempts = max_attempts
+        self.event = asyncio.Event()
+        self.task = None
+
+    def wake(self):
+        self.event.set()
+
+    def start(self):
+        _dispatchers.append(self)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self in _dispatchers:
+            _dispatchers.remove(self)
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def run(self):
+        while True:
+            self.event.clear()
+            try:
+                batch = await db_call(due_messages)
+                if batch:
+                    by_chat = defaultdict(list)
+                    for m in batch:
+                        by_chat[m.chat_id].append(m)
+                    await asyncio.gather(*(self._drain_chat(msgs) for msgs in by_chat.values()))
+                    continue
+                due = await db_call(next_message_due)
+                wait = IDLE_POLL_SEC if due is None else min(IDLE_POLL_SEC, max(0.0, (due - datetime.utcnow()).total_seconds()))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("outbox dispatcher error")
+                wait = IDLE_POLL_SEC
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _drain_chat(self, msgs: List[Outbox]):
+        for m in msgs:
+            await self.chat_buckets[m.chat_id].acquire()
+            await self.bucket.acquire()
+            if not await self._send(m):
+                # Keep per-chat order: the rest waits for the next pass.
+                return
+
+    async def _send(self, m: Outbox) -> bool:
+        kwargs = json.loads(m.payload)
+        if "reply_markup" in kwargs:
+            kwargs["reply_markup"] = InlineKeyboardMarkup.de_json(kwargs["reply_markup"], self.bot)
+        if m.method == "send_media_group":
+            # Album entries are {"photo": url or path, "caption": ...}; each one reuses a known file_id.
+            media, keys = [], []
+            for entry in kwargs["media"]:
+                photo, key, cached = await db_call(fileids.resolve, entry["photo"])
+                media.append(InputMediaPhoto(photo, caption=entry.get("caption"), parse_mode=entry.get("parse_mode")))
+                keys.append((key, cached))
+            kwargs["media"] = media
+            return await self._deliver(m, kwargs, keys)
+        photo = kwargs.get("photo") if m.method == "send_photo" else None
+        if not isinstance(photo, str):
+            return await self._deliver(m, kwargs)
+        # One upload of a photo at a time: a concurrent send of the same photo waits and reuses its file_id.
+        lock = self.photo_locks.setdefault(photo, asyncio.Lock())
+        try:
+            async with lock:
+                kwargs["photo"], key, cached = await db_call(fileids.resolve, photo)
+                return await self._deliver(m, kwargs, [(key, cached)])
+        finally:
+            if not lock.locked():
+                self.photo_locks.pop(photo, None)
+
+    async def _deliver(self, m: Outbox, kwargs: Dict, keys: List[Tuple[str, bool]] = ()) -> bool:
+        # keys: (file_id cache key, sent from cache) for each photo in the message, in order.
+        try:
+            with SEND_SECONDS.time(m.method):
+                sent = await getattr(self.bot, m.method)(chat_id=m.chat_id, **kwargs)
+        except RetryAfter as e:
+            SEND_RESULTS.inc(m.method, "retry_after")
+            logging.warning("outbox %s: flood control, retry in %ss", m.id, e.retry_after)
+            await db_write(mark_message, m.id, "pending", repr(e), _seconds(e.retry_after))
+            return False
+        except (BadRequest, Forbidden, InvalidToken) as e:
+            stale = [key for key, cached in keys if cached]
+            if stale and isinstance(e, BadRequest):
+                # Stale file_id: forget the cached ones and send the originals again right away.
+                SEND_RESULTS.inc(m.method, "retry")
+                logging.warning("outbox %s: cached file_id rejected, re-uploading: %r", m.id, e)
+                for key in stale:
+                    fileids.remember(key, None)
+                    await db_write(put_file_id, key, None)
+                await db_write(mark_message, m.id, "pending", repr(e), 0)
+                return False
+            SEND_RESULTS.inc(m.method, "failed")
+            logging.error("outbox %s: dropped: %r", m.id, e)
+            await db_write(mark_message, m.id, "failed", repr(e))
+            return True
+        except Exception as e:
+            failed = m.attempts + 1 >= self.max_attempts
+            SEND_RESULTS.inc(m.method, "failed" if failed else "retry")
+            delay = min(600, 2 ** m.attempts) * (1 + random.random() / 2)
+            logging.warning("outbox %s: send failed (attempt %s): %r", m.id, m.attempts + 1, e)
+            await db_write(mark_message, m.id, "failed" if failed else "pending", repr(e), None if failed else delay)
+            return False
+        SEND_RESULTS.inc(m.method, "sent")
+        for (key, cached), msg in zip(keys, sent if isinstance(sent, (list, tuple)) else [sent]):
+            if key and not cached and getattr(msg, "photo", None):
+                fileids.remember(key, msg.photo[-1].file_id)
+                await db_write(put_file_id, key, msg.photo[-1].file_id)
+        await db_write(mark_message, m.id, "sent")
+        return True
@@ -0,0 +1,54 @@
+import asyncio, logging
+from datetime import datetime
+from typing import Callable
+from storage.db import db_call, db_write, due_posts, next_post_due
+from delivery.outbox import notify
+
+MAX_SLEEP_SEC = 300
+_schedulers = []
+
+def wake():
+    for s in _schedulers:
+        s.event.set()
+
+class PostScheduler:
+    # One timer for all scheduled posts: sleeps until the earliest pending due_at in the DB
+    # (or until wake()), so pending posts survive restarts and no per-post job is kept in memory.
+    # publish(post_id, session=...) runs on the DB writer and returns True if it enqueued something.
+    def __init__(self, publish: Callable[..., bool]):
+        self.publish = publish
+        self.event = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        _schedulers.append(self)
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self in _schedulers:
+            _schedulers.remove(self)
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    async def run(self):
+        while True:
+            self.event.clear()
+            try:
+                published = 0
+                for post_id in await db_call(due_posts):
+                    published += await db_write(self.publish, post_id)
+                if published:
+                    notify()
+                    logging.info("Published %s scheduled posts", published)
+                due = await db_call(next_post_due)
+                wait = MAX_SLEEP_SEC if due is None else min(MAX_SLEEP_SEC, max(0.0, (due - datetime.utcnow()).total_seconds()))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("post scheduler error")
+                wait = MAX_SLEEP_SEC
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
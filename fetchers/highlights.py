@@ -0,0 +1,138 @@
+import hashlib, json, re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+EXTRA_PATTERNS = [r"\b[1-5]k\b", r"\b1v[1-5]\b", r"\bace\b", r"\bclutch\b",
+                  r"\brampage\b", r"\bultrakill\b", r"\bmonster kill\b",
+                  r"хайлайт", r"моменты", r"клатч", r"эйс", r"рампейдж", r"ультракилл"]
+TITLE_WEIGHT, SUMMARY_WEIGHT = 2.0, 1.0
+MAX_MATCHERS = 64
+_matchers: Dict[Tuple, "HighlightMatcher"] = {}
+
+def _trie_regex(words: Iterable[str]) -> str:
+    # Alternation of literals folded into a prefix trie, so the regex engine does not retry every word
+    # at every position. Longer words win, as with a length-sorted alternation.
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        alts = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        return "(?:" + body + ")?" if "" in node else body
+
+    return build(trie)
+
+def _is_word(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+class HighlightMatcher:
+    # Keywords are matched as plain substrings (case-insensitive), extra patterns as regexes.
+    # Title and summary are lowercased once and scanned in one pass; a negative keyword anywhere rejects the item.
+    # A leading \b (or any group) stops sre from skipping ahead by first character, so leading \b is stripped
+    # from the scan regex and checked per hit; `free` holds the alternatives that need no check.
+    def __init__(self, keywords: Iterable[str], negative: Iterable[str] = (), extra: Iterable[str] = EXTRA_PATTERNS):
+        words = {k.lower() for k in keywords if k}
+        free = [_trie_regex(words)] if words else []
+        parts = list(free)
+        self.bounded = False
+        for e in extra:
+            e = e.lower()
+            if e.startswith(r"\b"):
+                self.bounded = True
+                parts.append(e[2:])
+            else:
+                free.append(e)
+                parts.append(e)
+        self.pattern = re.compile("|".join(parts)) if parts else None
+        self.free = re.compile("|".join(free)) if free else None
+        neg = {k.lower() for k in negative if k}
+        self.negative = re.compile(_trie_regex(neg)) if neg else None
+
+    def _hits(self, text: str):
+        pos = 0
+        while True:
+            m = self.pattern.search(text, pos)
+            if m is None:
+                return
+            start = m.start()
+            if self.bounded and start > 0 and _is_word(text[start - 1]) == _is_word(text[start]):
+                # No word boundary here: only an unbounded alternative can match at this position.
+                m = self.free.match(text, start) if self.free else None
+                if m is None:
+                    pos = start + 1
+                    continue
+            yield m
+            pos = m.end() if m.end() > start else start + 1
+
+    def _text(self, item: Dict) -> Tuple[str, int]:
+        title = item.get("title", "") or ""
+        return f"{title}\n{item.get('summary', '') or ''}".lower(), len(title)
+
+    def matches(self, item: Dict) -> bool:
+        # Plain yes/no, stops at the first hit.
+        if self.pattern is None:
+            return False
+        text, _ = self._text(item)
+        return next(self._hits(text), None) is not None and not (self.negative and self.negative.search(text))
+
+    def score(self, item: Dict) -> Tuple[float, List[str]]:
+        # (relevance, matched terms); 0 means no match or a negative keyword.
+        if self.pattern is None:
+            return 0.0, []
+        text, split = self._text(item)
+        if self.negative and self.negative.search(text):
+            return 0.0, []
+        score, terms = 0.0, {}
+        for m in self._hits(text):
+            term = m.group(0).lower()
+            weight = TITLE_WEIGHT if m.start() < split else SUMMARY_WEIGHT
+            if weight > terms.get(term, 0):
+                score += weight - terms.get(term, 0)
+                terms[term] = weight
+        return score, list(terms)
+
+    def filter(self, items: Iterable[Dict], min_score: float = SUMMARY_WEIGHT) -> List[Dict]:
+        if min_score <= SUMMARY_WEIGHT:
+            # Any hit scores at least SUMMARY_WEIGHT, so a yes/no scan is enough.
+            return [it for it in items if self.matches(it)]
+        return [it for it in items if self.score(it)[0] >= min_score]
+
+    def rank(self, items: Iterable[Dict], min_score: float = SUMMARY_WEIGHT) -> List[Tuple[Dict, float, List[str]]]:
+        # Matching items with score and terms, best first.
+        out = []
+        for it in items:
+            score, terms = self.score(it)
+            if score >= min_score:
+                out.append((it, score, terms))
+        out.sort(key=lambda r: r[1], reverse=True)
+        return out
+
+def _spec(config: dict, game: Optional[str]) -> Dict:
+    filters = config.get("filters") or {}
+    gdata = (config.get("games") or {}).get(game) or {}
+    return {
+        "keywords": list(filters.get("highlight_keywords", []) or []) + list(gdata.get("highlight_keywords", []) or []),
+        "negative": list(filters.get("negative_keywords", []) or []) + list(gdata.get("negative_keywords", []) or []),
+    }
+
+def _cached(key: Tuple, keywords: List[str], negative: List[str] = ()) -> HighlightMatcher:
+    if key not in _matchers:
+        if len(_matchers) >= MAX_MATCHERS:
+            _matchers.clear()
+        _matchers[key] = HighlightMatcher(keywords, negative)
+    return _matchers[key]
+
+def get_matcher(config: dict, game: Optional[str] = None) -> HighlightMatcher:
+    # Compiled once per (game, config version); a changed sources.yaml yields a new matcher.
+    spec = _spec(config, game)
+    version = hashlib.sha1(json.dumps(spec, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+    return _cached((game, version), spec["keywords"], spec["negative"])
+
+def matcher_for_keywords(keywords: Iterable[str]) -> HighlightMatcher:
+    keywords = list(keywords)
+    return _cached(("keywords",) + tuple(keywords), keywords)
@@ -0,0 +1,97 @@
+import hashlib, html, random, re
+from array import array
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+NUM_PERM = 64
+BANDS, ROWS = 16, 4  # LSH: pairs above ~0.5 Jaccard share a band with high probability
+MIN_FEATURES = 4
+_PRIME = (1 << 61) - 1
+_rnd = random.Random(0x4E5854)  # fixed seed: signatures must be stable across restarts
+_PERMS = [(_rnd.randrange(1, _PRIME), _rnd.randrange(_PRIME)) for _ in range(NUM_PERM)]
+STOPWORDS = set("a an the to in of and on for at by with will be is are was after over from into as it its this that "
+                "и в во на по с со к о об от для из за что как это".split())
+_TAG_RE = re.compile(r"<[^>]+>")
+_URL_RE = re.compile(r"https?://\S+")
+_WORD_RE = re.compile(r"\w+")
+
+def normalize(text: str) -> List[str]:
+    text = html.unescape(_TAG_RE.sub(" ", text or ""))
+    return [w for w in _WORD_RE.findall(_URL_RE.sub(" ", text).lower()) if w not in STOPWORDS]
+
+def _h64(s: str) -> int:
+    return int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+
+def minhash(text: str) -> Optional[Tuple[int, ...]]:
+    # MinHash signature over the normalized word set; None when the text is too short to compare.
+    feats = {_h64(w) for w in normalize(text)}
+    if len(feats) < MIN_FEATURES:
+        return None
+    return tuple(min((a * h + b) % _PRIME for h in feats) & 0xFFFFFFFF for a, b in _PERMS)
+
+def similarity(a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+    # Estimated Jaccard similarity of the two word sets.
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERM
+
+def pack(sig: Tuple[int, ...]) -> bytes:
+    return array("I", sig).tobytes()
+
+def unpack(blob: bytes) -> Tuple[int, ...]:
+    return tuple(array("I", blob))
+
+class NearDupIndex:
+    # MinHash + LSH banding: a lookup only compares against items sharing a band bucket with the query,
+    # not against every stored signature. Entries older than `window` fall out.
+    def __init__(self, window: timedelta = timedelta(hours=48), threshold: float = 0.7):
+        self.window = window
+        self.threshold = threshold
+        self.buckets: List[Dict[Tuple[int, ...], Set[str]]] = [dict() for _ in range(BANDS)]
+        self.entries: Dict[str, Tuple[Tuple[int, ...], datetime]] = {}
+        self.order = deque()
+
+    @staticmethod
+    def _bands(sig: Tuple[int, ...]):
+        return [sig[b * ROWS:(b + 1) * ROWS] for b in range(BANDS)]
+
+    def add(self, key: str, sig: Tuple[int, ...], ts: Optional[datetime] = None):
+        if key in self.entries:
+            return
+        ts = ts or datetime.utcnow()
+        self.entries[key] = (sig, ts)
+        self.order.append((ts, key))
+        for b, band in enumerate(self._bands(sig)):
+            self.buckets[b].setdefault(band, set()).add(key)
+
+    def prune(self, now: Optional[datetime] = None):
+        cutoff = (now or datetime.utcnow()) - self.window
+        while self.order and self.order[0][0] < cutoff:
+            _, key = self.order.popleft()
+            sig, _ = self.entries.pop(key, (None, None))
+            if sig is None:
+                continue
+            for b, band in enumerate(self._bands(sig)):
+                bucket = self.buckets[b].get(band)
+                if bucket:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self.buckets[b][band]
+
+    def find(self, sig: Tuple[int, ...], exclude: Optional[str] = None) -> Optional[str]:
+        # Key of the most similar stored item at or above the threshold, if any. `exclude` is the item's own
+        # key: a retried batch finds the entries it added before failing, and must not match itself.
+        best, best_sim = None, self.threshold
+        seen = {exclude}
+        for b, band in enumerate(self._bands(sig)):
+            for key in self.buckets[b].get(band, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                sim = similarity(sig, self.entries[key][0])
+                if sim >= best_sim:
+                    best, best_sim = key, sim
+        return best
+
+    def warm(self, rows: Iterable[Tuple[str, Tuple[int, ...], datetime]]):
+        for key, sig, ts in sorted(rows, key=lambda r: r[2]):
+            self.add(key, sig, ts)
@@ -0,0 +1,181 @@
+import asyncio, hashlib, json, logging, math, os, random, time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from utils.metrics import Gauge
+
+POLL_STATE_PATH = "storage/poll_state.json"
+EWMA_ALPHA = 0.3
+JITTER = 0.1
+BATCH_WINDOW_SEC = 60
+STARTUP_SPREAD_SEC = 300
+MAX_SLEEP_SEC = 300
+POLL_INTERVAL = Gauge("nxt_feed_poll_interval_seconds", "Planned poll interval per feed", ["feed"])
+
+Poll = Callable[[Optional[List[str]]], Awaitable[Tuple[Dict[str, List[Dict]], Set[str]]]]
+
+def _phase(url: str) -> float:
+    # Stable per-feed fraction in [0, 1), so feeds with equal intervals do not fire together.
+    return int.from_bytes(hashlib.sha1(url.encode()).digest()[:4], "big") / 2 ** 32
+
+class FeedPoller:
+    # One timer for all feeds. Each feed's update rate is learned from the published times of its new
+    # entries (EWMA of the gap between entries; a silent feed slows down as the time since its last entry
+    # grows). Poll intervals share a fixed request budget (len(feeds) polls per `interval` seconds, i.e.
+    # no more requests than polling everything at `interval`) in proportion to sqrt(rate), clamped to
+    # [min_interval, max_interval]. Failing feeds back off exponentially with jitter.
+    # poll(urls) fetches the given feeds (None = all, on demand) and returns ({url: new items}, failed urls).
+    def __init__(self, sources: Callable[[], Iterable[str]], poll: Poll, *, interval: float,
+                 min_interval: float, max_interval: float, path: str = POLL_STATE_PATH):
+        self.sources = sources
+        self.poll = poll
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.path = path
+        self.state: Dict[str, Dict] = {}
+        self.intervals: Dict[str, float] = {}
+        self.urls: List[str] = []
+        self.started = time.time()
+        self.lock = asyncio.Lock()
+        self.event = asyncio.Event()
+        self.task = None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+        except (OSError, ValueError):
+            self.state = {}
+
+    def start(self):
+        self.started = time.time()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def wake(self):
+        self.event.set()
+
+    def retune(self, interval: Optional[float] = None, min_interval: Optional[float] = None,
+               max_interval: Optional[float] = None):
+        if interval is not None:
+            self.interval = interval
+        if min_interval is not None:
+            self.min_interval = min_interval
+        if max_interval is not None:
+            self.max_interval = max_interval
+        self.plan(time.time())
+        self.wake()
+
+    def rate(self, url: str, now: float) -> float:
+        st = self.state.get(url, {})
+        if not st.get("gap"):
+            return 1 / self.interval
+        gap = st["gap"]
+        if st.get("last_entry"):
+            gap = max(gap, now - st["last_entry"])
+        return 1 / max(gap, 1.0)
+
+    def _allocate(self, rates: Dict[str, float]) -> Dict[str, float]:
+        # interval_i = c / sqrt(rate_i) with sum(1 / interval_i) = budget; feeds clamped at min_interval
+        # use up their share first and the rest is split again.
+        budget = len(rates) / self.interval
+        out: Dict[str, float] = {}
+        free = dict(rates)
+        while free:
+            left = budget - sum(1 / iv for iv in out.values())
+            if left <= 0:
+                out.update({u: self.max_interval for u in free})
+                break
+            c = sum(math.sqrt(r) for r in free.values()) / left
+            low = [u for u, r in free.items() if c / math.sqrt(r) < self.min_interval]
+            if not low:
+                out.update({u: min(self.max_interval, c / math.sqrt(r)) for u, r in free.items()})
+                break
+            for u in low:
+                out[u] = self.min_interval
+                del free[u]
+        return out
+
+    def plan(self, now: float):
+        self.urls = list(dict.fromkeys(self.sources()))
+        self.intervals = self._allocate({u: self.rate(u, now) for u in self.urls})
+        for url, iv in self.intervals.items():
+            st = self.state.setdefault(url, {})
+            POLL_INTERVAL.set(iv, url)
+            if st.get("failures"):
+                continue  # keeps its backoff
+            if st.get("last_poll"):
+                st["next_at"] = st["last_poll"] + iv * (1 - JITTER + 2 * JITTER * _phase(url))
+            else:
+                st["next_at"] = self.started + _phase(url) * min(iv, STARTUP_SPREAD_SEC)
+
+    def observe(self, url: str, items: List[Dict], failed: bool, now: float):
+        st = self.state.setdefault(url, {})
+        st["last_poll"] = now
+        if failed:
+            st["failures"] = st.get("failures", 0) + 1
+            iv = self.intervals.get(url, self.interval)
+            st["next_at"] = now + min(self.max_interval, iv * 2 ** st["failures"]) * (1 + random.random() / 2)
+            return
+        st["failures"] = 0
+        times = sorted(it["published"] for it in items if it.get("published")) or ([now] if items else [])
+        last = st.get("last_entry")
+        for t in times:
+            if last is not None and t > last:
+                gap = t - last
+                st["gap"] = gap if st.get("gap") is None else EWMA_ALPHA * gap + (1 - EWMA_ALPHA) * st["gap"]
+            last = t if last is None else max(last, t)
+        st["last_entry"] = last
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({u: st for u, st in self.state.items() if u in self.intervals}, f)
+        os.replace(tmp, self.path)
+
+    def due(self, now: float) -> List[str]:
+        # Feeds due a little later ride along, so polls come in batches rather than one feed at a time.
+        window = min(BATCH_WINDOW_SEC, self.min_interval * (1 - JITTER) / 2)
+        return [u for u in self.urls if self.state.get(u, {}).get("next_at", 0) <= now + window]
+
+    def next_due(self) -> Optional[float]:
+        return min((self.state[u]["next_at"] for u in self.urls if "next_at" in self.state.get(u, {})), default=None)
+
+    async def poll_now(self, urls: Optional[List[str]] = None):
+        # urls=None polls every feed (manual run); results feed the rate estimates either way.
+        async with self.lock:
+            wanted = urls if urls is not None else list(dict.fromkeys(self.sources()))
+            try:
+                feeds, failed = await self.poll(urls)
+            except Exception:
+                logging.exception("feed poll failed")
+                feeds, failed = {}, set(wanted)
+            now = time.time()
+            for url in wanted:
+                self.observe(url, feeds.get(url, []), url in failed, now)
+            self.plan(now)
+            await asyncio.to_thread(self.save)
+            return feeds, failed
+
+    async def run(self):
+        while True:
+            self.event.clear()
+            try:
+                self.plan(time.time())  # picks up sources.yaml changes
+                batch = self.due(time.time())
+                if batch:
+                    await self.poll_now(batch)
+                    continue
+                due = self.next_due()
+                wait = MAX_SLEEP_SEC if due is None else min(MAX_SLEEP_SEC, max(0.0, due - time.time()))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("feed poller error")
+                wait = MAX_SLEEP_SEC
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
@@ -1,5 +1,77 @@
-import feedparser, yaml, re
-from typing import List, Dict, Optional
+import asyncio, calendar, hashlib, json, logging, os, yaml
+from collections import defaultdict, deque
+from itertools import islice
+from typing import List, Dict, Iterable, Iterator, Optional
+from urllib.parse import urlsplit
+import aiohttp
+from fetchers.highlights import matcher_for_keywords
+from utils.metrics import Counter, Histogram
+
+FEED_HEADERS = {"User-Agent": "NXT-Esports-Bot/1.0 (+https://t.me/NXT_Esports)"}
+FEED_CACHE_PATH = "storage/feed_cache.json"
+YOUTUBE_FEED_URL = os.getenv("YOUTUBE_FEED_URL", "https://www.youtube.com/feeds/videos.xml?channel_id={}")
+SEEN_GUIDS_MAX = 200
+FEED_DOWNLOAD = Histogram("nxt_feed_download_seconds", "Feed download time", ["host"])
+FEED_PARSE = Histogram("nxt_feed_parse_seconds", "Feed parse time", ["host"])
+FEED_RESULTS = Counter("nxt_feed_fetches_total", "Feed fetches by result", ["host", "result"])
+
+class FeedCache:
+    # Per-feed validators (ETag / Last-Modified), body hash and high-water marks (newest published time,
+    # recent GUIDs), persisted as JSON between restarts. Updates from a fetch stay pending until save(),
+    # so a cycle that fails before its items are stored is fetched again in full.
+    def __init__(self, path: str = FEED_CACHE_PATH):
+        self.path = path
+        self.feeds: Dict[str, Dict] = {}
+        self.pending: Dict[str, Dict] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.feeds = json.load(f)
+        except (OSError, ValueError):
+            self.feeds = {}
+
+    def request_headers(self, url: str) -> Dict[str, str]:
+        st = self.feeds.get(url, {})
+        headers = {}
+        if st.get("etag"):
+            headers["If-None-Match"] = st["etag"]
+        if st.get("last_modified"):
+            headers["If-Modified-Since"] = st["last_modified"]
+        return headers
+
+    def is_unchanged(self, url: str, digest: str) -> bool:
+        return self.feeds.get(url, {}).get("hash") == digest
+
+    def update(self, url: str, **fields):
+        self.pending.setdefault(url, {}).update(fields)
+
+    def marks(self, url: str):
+        st = self.feeds.get(url, {})
+        return set(st.get("guids", [])), st.get("high_water")
+
+    def update_marks(self, url: str, items: List[Dict]):
+        # Newest published time and the GUIDs of the given entries (plus the ones kept before).
+        if not items:
+            return
+        st = self.feeds.get(url, {})
+        times = [it["published"] for it in items if it.get("published")]
+        high_water = max(times + ([st["high_water"]] if st.get("high_water") else []), default=None)
+        guids = list(dict.fromkeys([it["guid"] for it in items] + st.get("guids", [])))[:SEEN_GUIDS_MAX]
+        self.update(url, high_water=high_water, guids=guids)
+
+    def discard(self):
+        self.pending.clear()
+
+    def save(self):
+        if not self.pending:
+            return
+        for url, fields in self.pending.items():
+            self.feeds.setdefault(url, {}).update(fields)
+        self.pending.clear()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.feeds, f)
+        os.replace(tmp, self.path)
 
 def load_config(path: str="sources.yaml") -> dict:
     with open(path, "r", encoding="utf-8") as f:
@@ -23,34 +95,124 @@ def _extract_thumb(entry) -> Optional[str]:
     # generic
     return None
 
-def parse_rss(url: str) -> List[Dict]:
-    d = feedparser.parse(url)
-    items = []
+def _entry_time(e) -> Optional[float]:
+    t = e.get("published_parsed") or e.get("updated_parsed")
+    return float(calendar.timegm(t)) if t else None
+
+def _newest_first(entries) -> Optional[bool]:
+    # Feeds are usually newest first, but not all are; compare the first and the last dated entry.
+    # None when that tells nothing (fewer than two dates, or the same one).
+    times = [t for t in map(_entry_time, entries) if t is not None]
+    if len(times) < 2 or times[0] == times[-1]:
+        return None
+    return times[0] > times[-1]
+
+def iter_items(d, seen_guids=frozenset(), high_water: Optional[float] = None) -> Iterator[Dict]:
+    # Entries as item dicts, lazily and in feed order. Skips entries already seen (known GUID) or older than
+    # the newest one seen before; only in a feed known to be newest-first is everything after a known GUID
+    # older, so only there it stops.
+    newest_first = _newest_first(d.entries)
     for e in d.entries:
-        title = getattr(e, "title", "")
         link = getattr(e, "link", "")
-        summary = getattr(e, "summary", getattr(e, "description", ""))
-        thumb = _extract_thumb(e)
-        items.append({
-            "title": title,
+        guid = e.get("id") or link
+        published = _entry_time(e)
+        if guid in seen_guids:
+            if newest_first:
+                return
+            continue
+        if published is not None and high_water is not None and published < high_water:
+            continue
+        yield {
+            "title": getattr(e, "title", ""),
             "url": link,
-            "summary": summary,
-            "image_url": thumb
-        })
-    return items
+            "summary": getattr(e, "summary", getattr(e, "description", "")),
+            "image_url": _extract_thumb(e),
+            "guid": guid,
+            "published": published,
+        }
+
+def _entries_to_items(d) -> List[Dict]:
+    return list(iter_items(d))
+
+def parse_rss(url: str) -> List[Dict]:
+    import feedparser
+    return _entries_to_items(feedparser.parse(url))
+
+def parse_feed_bytes(body: bytes, content_type: str = "", seen_guids=frozenset(), high_water: Optional[float] = None,
+                     max_entries: Optional[int] = None) -> List[Dict]:
+    import feedparser  # loaded with the first feed, not at startup
+    headers = {"content-type": content_type} if content_type else None
+    d = feedparser.parse(body, response_headers=headers)
+    items = iter_items(d, seen_guids, high_water)
+    if max_entries is not None and _newest_first(d.entries) is False:
+        # Oldest first: the newest max_entries are the last ones. Taking the first would keep the oldest, and
+        # the rest would wait until the body changes (an unchanged body is not parsed again).
+        return list(deque(items, maxlen=max_entries))
+    return list(islice(items, max_entries))
+
+async def _fetch_feed(session: aiohttp.ClientSession, url: str, timeout: float, headers: Dict[str, str]):
+    async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+        if r.status == 304:
+            return None, r.headers
+        r.raise_for_status()
+        return await r.read(), r.headers
+
+async def fetch_feeds(urls: Iterable[str], *, limit: int = 20, per_host: int = 4, timeout: float = 20.0,
+                      cache: Optional[FeedCache] = None, max_entries: Optional[int] = None):
+    # Download all feeds concurrently; parsing runs in a worker thread so the loop stays free.
+    # Slots are taken before the timeout starts, so a feed waiting for its host never times out in the queue.
+    # With a cache, requests are conditional, a 304 or an identical body skips parsing, and only entries
+    # newer than the feed's high-water mark are returned (at most max_entries per feed).
+    # Returns ({url: items}, stats); unchanged and failed feeds map to [].
+    # The caller saves the cache once the items are stored, so a crash mid-cycle does not lose entries.
+    urls = list(dict.fromkeys(urls))
+    total = asyncio.Semaphore(limit)
+    hosts = defaultdict(lambda: asyncio.Semaphore(per_host))
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=per_host, ttl_dns_cache=300)
+    stats = {"fetched": 0, "unchanged": 0, "failed": 0, "bytes": 0, "failed_urls": []}
+    if cache:
+        cache.discard()
+
+    async def one(session, url):
+        host = urlsplit(url).netloc
+        try:
+            async with hosts[host], total:
+                with FEED_DOWNLOAD.time(host):
+                    body, headers = await _fetch_feed(session, url, timeout, cache.request_headers(url) if cache else {})
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logging.warning("feed %s failed: %r", url, e)
+            stats["failed"] += 1
+            stats["failed_urls"].append(url)
+            FEED_RESULTS.inc(host, "failed")
+            return url, []
+        if body is None:
+            stats["unchanged"] += 1
+            FEED_RESULTS.inc(host, "unchanged")
+            return url, []
+        stats["bytes"] += len(body)
+        if cache:
+            digest = hashlib.sha256(body).hexdigest()
+            unchanged = cache.is_unchanged(url, digest)
+            cache.update(url, etag=headers.get("ETag"), last_modified=headers.get("Last-Modified"), hash=digest)
+            if unchanged:
+                stats["unchanged"] += 1
+                FEED_RESULTS.inc(host, "unchanged")
+                return url, []
+        stats["fetched"] += 1
+        FEED_RESULTS.inc(host, "changed")
+        seen, high_water = cache.marks(url) if cache else (frozenset(), None)
+        with FEED_PARSE.time(host):
+            items = await asyncio.to_thread(parse_feed_bytes, body, headers.get("Content-Type", ""), seen, high_water, max_entries)
+        if cache:
+            cache.update_marks(url, items)
+        return url, items
+
+    async with aiohttp.ClientSession(connector=connector, headers=FEED_HEADERS) as session:
+        pairs = await asyncio.gather(*(one(session, u) for u in urls))
+    return dict(pairs), stats
 
 def youtube_channel_feed(channel_id: str) -> str:
-    return f"https://www.youtube.com/feeds/videos.xml?channel_id={channel_id}"
+    return YOUTUBE_FEED_URL.format(channel_id)
 
 def filter_highlights(items: List[Dict], keywords: List[str]) -> List[Dict]:
-    base = [re.escape(k) for k in keywords]
-    extra = [r"\b[1-5]k\b", r"\b1v[1-5]\b", r"\bace\b", r"\bclutch\b",
-             r"\brampage\b", r"\bultrakill\b", r"\bmonster kill\b",
-             r"хайлайт", r"моменты", r"клатч", r"эйс", r"рампейдж", r"ультракилл"]
-    patt = re.compile("|".join(base + extra), re.IGNORECASE)
-    out = []
-    for it in items:
-        t = it.get("title",""); s = it.get("summary","")
-        if patt.search(t) or patt.search(s):
-            out.append(it)
-    return out
+    return matcher_for_keywords(keywords).filter(items)
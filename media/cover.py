@@ -1,12 +1,21 @@
 
-import os, io, math, tempfile, requests
+import os, io, math, asyncio
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
+from functools import lru_cache, partial
+from media.imagecache import default_cache
+from utils.metrics import Histogram
 
 WIDTH, HEIGHT = 1280, 720
+TITLE_MAX_SIZE, TITLE_MIN_SIZE = 68, 32
+COVER_WORKERS = int(os.getenv("COVER_WORKERS") or 0) or None  # None = one per CPU
+_pool = None
+COVER_SECONDS = Histogram("nxt_cover_render_seconds", "Cover render time", ["mode"])
 
+@lru_cache(maxsize=64)
 def _load_font(size: int):
     # Try common fonts; fall back to default bitmap font.
+    from PIL import ImageFont
     for name in ["DejaVuSans-Bold.ttf", "DejaVuSans.ttf", "Arial.ttf"]:
         try:
             return ImageFont.truetype(name, size)
@@ -60,18 +69,54 @@ def _dominant_color(img):
     idx = counts[0][1]
     return pal.palette.getcolor(idx)
 
+@lru_cache(maxsize=4)
+def _gradient_mask(width: int, height: int):
+    # Top-to-bottom darkening mask, darker at bottom; built once per size.
+    from PIL import Image
+    column = Image.frombytes("L", (1, height), bytes(int(180 * (y/height)) for y in range(height)))
+    return column.resize((width, height))
+
+@lru_cache(maxsize=4)
+def _black(width: int, height: int):
+    from PIL import Image
+    return Image.new("RGB", (width, height), (0,0,0))
+
+def _overlay(img):
+    from PIL import Image
+    return Image.composite(_black(*img.size), img, _gradient_mask(*img.size))
+
+def _fits(draw, text, size, maxw):
+    font = _load_font(size)
+    lines = _wrap(draw, text, font, maxw)
+    return len(lines) <= 3 and max(draw.textlength(ln, font=font) for ln in lines) <= maxw, font, lines
+
+def _fit_title(draw, text, maxw):
+    # Largest font size in [TITLE_MIN_SIZE, TITLE_MAX_SIZE] that fits in 3 lines, by binary search.
+    ok, font, lines = _fits(draw, text, TITLE_MAX_SIZE, maxw)
+    if ok:
+        return font, lines
+    lo, hi = TITLE_MIN_SIZE, TITLE_MAX_SIZE - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        ok, font, lines = _fits(draw, text, mid, maxw)
+        if ok:
+            best, lo = (font, lines), mid + 1
+        else:
+            hi = mid - 1
+    return best or _fits(draw, text, TITLE_MIN_SIZE, maxw)[1:]
+
 def _download(url):
-    try:
-        r = requests.get(url, timeout=10)
-        r.raise_for_status()
-        fd, p = tempfile.mkstemp(suffix=".img")
-        with os.fdopen(fd, "wb") as f:
-            f.write(r.content)
-        return p
-    except Exception:
-        return None
+    # Served from the shared image cache; only a miss goes to the network.
+    return default_cache().get(url)
 
-def generate_cover(title: str, *, tag: str = "HIGHLIGHT", subtitle: str = "", bg_url: str = None, out_dir: str = "./covers") -> str:
+def generate_cover(title: str, **kwargs) -> str:
+    with COVER_SECONDS.time("inline"):
+        return _generate_cover(title, **kwargs)
+
+def _generate_cover(title: str, *, tag: str = "HIGHLIGHT", subtitle: str = "", bg_url: str = None, out_dir: str = "./covers") -> str:
+    # PIL is imported on the first render (in the worker process for render_cover), not with this module.
+    from PIL import Image, ImageDraw, ImageFilter
     os.makedirs(out_dir, exist_ok=True)
     bg_path = None
     if bg_url and bg_url.startswith(("http://","https://")):
@@ -91,15 +136,8 @@ def generate_cover(title: str, *, tag: str = "HIGHLIGHT", subtitle: str = "", bg
     else:
         img = Image.new("RGB", (WIDTH, HEIGHT), (18, 20, 26))
 
-    draw = ImageDraw.Draw(img)
-
     # Gradient overlay (top-to-bottom)
-    grad = Image.new("L", (1, HEIGHT), color=0)
-    for y in range(HEIGHT):
-        # darker at bottom
-        grad.putpixel((0, y), int(180 * (y/HEIGHT)))
-    grad = grad.resize((WIDTH, HEIGHT))
-    img = Image.composite(Image.new("RGB", (WIDTH, HEIGHT), (0,0,0)), img, grad)
+    img = _overlay(img)
     draw = ImageDraw.Draw(img)
 
     # Dominant color for accents
@@ -121,12 +159,8 @@ def generate_cover(title: str, *, tag: str = "HIGHLIGHT", subtitle: str = "", bg
     draw.text((bx + padx, by + pady - 2), badge_text, font=bfont, fill=text_color)
 
     # Title
-    tfont = _load_font(68)
     maxw = int(WIDTH * 0.86)
-    lines = _wrap(draw, title or "NXT Esports", tfont, maxw)
-    while (len(lines) > 3 or max(draw.textlength(ln, font=tfont) for ln in lines) > maxw) and getattr(tfont, "size", 68) > 34:
-        tfont = _load_font(getattr(tfont, "size", 68)-4)
-        lines = _wrap(draw, title or "NXT Esports", tfont, maxw)
+    tfont, lines = _fit_title(draw, title or "NXT Esports", maxw)
 
     y = by + bh + 2*pady + 28
     for ln in lines:
@@ -153,3 +187,21 @@ def generate_cover(title: str, *, tag: str = "HIGHLIGHT", subtitle: str = "", bg
     out_path = os.path.join(out_dir, f"cover_{datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}.png")
     img.save(out_path, "PNG")
     return out_path
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=COVER_WORKERS)
+    return _pool
+
+async def render_cover(title: str, **kwargs) -> str:
+    # Renders in a worker process, so several covers render in parallel off the event loop.
+    loop = asyncio.get_running_loop()
+    with COVER_SECONDS.time("pool"):
+        return await loop.run_in_executor(_executor(), partial(_generate_cover, title, **kwargs))
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
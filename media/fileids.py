@@ -0,0 +1,57 @@
+import hashlib, os
+from typing import Dict, Optional, Tuple
+from storage.db import get_file_id
+from media.imagecache import default_cache
+from utils.metrics import Counter
+
+FILE_IDS_MAX = 10_000
+# key -> Telegram file_id, in front of the media_files table.
+_file_ids: Dict[str, str] = {}
+PHOTO_SOURCES = Counter("nxt_photo_sends_total", "Photos sent by source", ["source"])
+
+def media_key(photo: str) -> Optional[str]:
+    # "url:<url>" for remote images, "sha256:<hash>" for local files (covers); None for a file_id.
+    if photo.startswith(("http://", "https://")):
+        return "url:" + photo
+    if os.path.isfile(photo):
+        h = hashlib.sha256()
+        with open(photo, "rb") as f:
+            for block in iter(lambda: f.read(1 << 16), b""):
+                h.update(block)
+        return "sha256:" + h.hexdigest()
+    return None
+
+def lookup(key: str) -> Optional[str]:
+    file_id = _file_ids.get(key)
+    if file_id is None:
+        file_id = get_file_id(key)
+        if file_id:
+            remember(key, file_id)
+    return file_id
+
+def remember(key: str, file_id: Optional[str]):
+    if file_id is None:
+        _file_ids.pop(key, None)
+        return
+    if len(_file_ids) >= FILE_IDS_MAX:
+        _file_ids.clear()
+    _file_ids[key] = file_id
+
+def resolve(photo: str) -> Tuple[object, Optional[str], bool]:
+    # What to send as `photo` and under which key to record the resulting file_id: the cached file_id if
+    # this media was uploaded before, else the local bytes (a cover, or the remote image already in the
+    # image cache, so Telegram never has to fetch the source CDN), else the URL. Returns (photo, key, cached).
+    key = media_key(photo)
+    if key is None:
+        return photo, None, False
+    file_id = lookup(key)
+    if file_id:
+        PHOTO_SOURCES.inc("file_id")
+        return file_id, key, True
+    path = photo if key.startswith("sha256:") else default_cache().path_for(photo)
+    if path:
+        PHOTO_SOURCES.inc("upload")
+        with open(path, "rb") as f:
+            return f.read(), key, False
+    PHOTO_SOURCES.inc("url")
+    return photo, key, False
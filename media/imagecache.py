@@ -0,0 +1,188 @@
+import os, asyncio, hashlib, json, logging, tempfile, threading, time
+from typing import Dict, Iterable, Optional
+import aiohttp
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR") or "storage/images"
+IMAGE_CACHE_MAX_MB = int(os.getenv("IMAGE_CACHE_MAX_MB") or 200)
+STALE_TMP_SEC = 3600
+_default = None
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+def _scan(path: str) -> Dict[str, os.stat_result]:
+    # Entries of a directory with their stat; files removed meanwhile (e.g. by another process) are skipped.
+    out = {}
+    for e in os.scandir(path):
+        try:
+            out[e.path] = e.stat()
+        except OSError:
+            pass
+    return out
+
+class ImageCache:
+    # Content-addressed image store: blobs/<sha256 of bytes>, urls/<sha256 of url>.json with the blob hash
+    # and HTTP validators. Every file is written via temp file + rename, so worker processes can share it.
+    # Least recently used URLs are evicted once blobs exceed max_bytes.
+    def __init__(self, root: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.blobs = os.path.join(root, "blobs")
+        self.urls = os.path.join(root, "urls")
+        self.tmp = os.path.join(root, "tmp")
+        self._total = None  # bytes in blobs/, scanned lazily and kept up to date by store()
+        self._lock = threading.Lock()
+        for d in (self.blobs, self.urls, self.tmp):
+            os.makedirs(d, exist_ok=True)
+        self._purge_tmp()
+
+    def _purge_tmp(self):
+        cutoff = time.time() - STALE_TMP_SEC
+        for path, st in _scan(self.tmp).items():
+            if st.st_mtime < cutoff:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _write(self, path: str, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=self.tmp)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def _meta(self, url: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self.urls, _url_key(url) + ".json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if os.path.exists(os.path.join(self.blobs, meta["sha"])) else None
+
+    def path_for(self, url: str) -> Optional[str]:
+        # Cached file for url, or None. Marks the entry as recently used.
+        meta = self._meta(url)
+        if not meta:
+            return None
+        try:
+            os.utime(os.path.join(self.urls, _url_key(url) + ".json"))
+        except OSError:
+            pass
+        return os.path.join(self.blobs, meta["sha"])
+
+    def request_headers(self, url: str) -> Dict[str, str]:
+        meta = self._meta(url) or {}
+        headers = {}
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def store(self, url: str, body: bytes, etag: Optional[str] = None, last_modified: Optional[str] = None) -> str:
+        sha = hashlib.sha256(body).hexdigest()
+        blob = os.path.join(self.blobs, sha)
+        meta = {"url": url, "sha": sha, "etag": etag, "last_modified": last_modified, "size": len(body)}
+        with self._lock:
+            if not os.path.exists(blob):
+                self._write(blob, body)
+                if self._total is not None:
+                    self._total += len(body)
+            self._write(os.path.join(self.urls, _url_key(url) + ".json"), json.dumps(meta).encode())
+            if self._total is None or self._total > self.max_bytes:
+                self._evict()
+        return blob
+
+    def get(self, url: str, timeout: float = 10) -> Optional[str]:
+        # Local path for url, downloading (conditionally, if already cached) when needed.
+        path = self.path_for(url)
+        if path:
+            return path
+        try:
+            import requests  # blocking path only (covers); prefetch uses aiohttp
+            r = requests.get(url, timeout=timeout)
+            r.raise_for_status()
+        except Exception:
+            return None
+        return self.store(url, r.content, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+
+    async def prefetch(self, urls: Iterable[str], *, concurrency: int = 8, timeout: float = 10) -> int:
+        # Download missing or changed images concurrently; returns how many were stored.
+        urls = [u for u in dict.fromkeys(urls) if u and u.startswith(("http://", "https://"))]
+        if not urls:
+            return 0
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(session, url):
+            try:
+                async with sem, session.get(url, headers=self.request_headers(url),
+                                            timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                    if r.status == 304:
+                        return 0
+                    r.raise_for_status()
+                    body = await r.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.debug("image prefetch %s failed: %r", url, e)
+                return 0
+            await asyncio.to_thread(self.store, url, body, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+            return 1
+
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+            return sum(await asyncio.gather(*(one(session, u) for u in urls)))
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        blobs = {os.path.basename(p): st.st_size for p, st in _scan(self.blobs).items()}
+        total = self._total = sum(blobs.values())
+        if total <= self.max_bytes:
+            return
+        metas = sorted(_scan(self.urls).items(), key=lambda kv: kv[1].st_mtime)
+        refs = {}
+        for path, _ in metas:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    refs[path] = json.load(f).get("sha")
+            except (OSError, ValueError):
+                refs[path] = None
+        live = {}
+        for sha in refs.values():
+            live[sha] = live.get(sha, 0) + 1
+        for path, _ in metas:
+            if total <= self.max_bytes:
+                break
+            sha = refs[path]
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            live[sha] = live.get(sha, 1) - 1
+            if sha in blobs and live[sha] <= 0:
+                try:
+                    os.unlink(os.path.join(self.blobs, sha))
+                except OSError:
+                    pass
+                total -= blobs.pop(sha)
+        # Blobs no URL points to any more (e.g. an image changed under the same URL).
+        for sha in [s for s in blobs if live.get(s, 0) <= 0]:
+            try:
+                os.unlink(os.path.join(self.blobs, sha))
+            except OSError:
+                pass
+            total -= blobs.pop(sha)
+        self._total = total
+
+def default_cache() -> ImageCache:
+    global _default
+    if _default is None:
+        _default = ImageCache()
+    return _default
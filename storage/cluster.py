@@ -0,0 +1,110 @@
+import asyncio, hashlib, logging, time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+from storage.db import db_call, db_write, acquire_lease, release_lease, heartbeat, leave, live_workers, prune_cluster
+from utils.metrics import Gauge
+
+HEARTBEAT_SEC = 5
+WORKER_TTL_SEC = 20  # a worker without a heartbeat for this long is dead and its feeds move
+LEASE_TTL_SEC = 20
+LEADER_LEASE = "leader"
+PRUNE_AFTER = timedelta(days=1)
+CLUSTER_WORKERS = Gauge("nxt_cluster_workers", "Live workers seen by this node")
+CLUSTER_LEADER = Gauge("nxt_cluster_leader", "1 while this node holds the leader lease")
+
+def _score(worker: str, key: str) -> bytes:
+    return hashlib.sha1(f"{worker}|{key}".encode()).digest()
+
+def owner(workers: List[str], key: str) -> Optional[str]:
+    # Rendezvous hashing: a key belongs to the worker with the highest hash(worker, key), so when a worker
+    # joins or leaves only that worker's keys move.
+    return max(workers, key=lambda w: _score(w, key), default=None)
+
+class Cluster:
+    # Membership and leadership over the shared database. Every node heartbeats into `workers` and owns the
+    # feeds that rendezvous-hash to it among the live ones. Nodes with lead=True compete for the leader
+    # lease; the holder renews it every heartbeat and steps down on its own once it has gone LEASE_TTL_SEC
+    # - HEARTBEAT_SEC without a renewal, i.e. before anyone else can take the lease over.
+    def __init__(self, worker_id: str, *, lead: bool,
+                 on_elected: Callable[[], Awaitable] = None, on_demoted: Callable[[], Awaitable] = None,
+                 on_members: Callable[[], None] = None, on_tick: Callable[[], None] = None):
+        self.worker_id = worker_id
+        self.lead = lead
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.on_members = on_members
+        self.on_tick = on_tick  # called every heartbeat while leading
+        self.members = [worker_id]
+        self.leader = False
+        self.renewed_at = 0.0
+        self.task = None
+
+    def owns(self, key: str) -> bool:
+        return owner(self.members, key) == self.worker_id
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        if self.leader:
+            await self._demote()
+        try:
+            # Leave at once so the others rebalance and elect without waiting for the TTLs.
+            await db_write(release_lease, LEADER_LEASE, self.worker_id)
+            await db_write(leave, self.worker_id)
+        except Exception:
+            logging.exception("cluster: leave failed")
+
+    async def run(self):
+        while True:
+            try:
+                await self.beat()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception("cluster heartbeat failed")
+            if self.leader and time.monotonic() - self.renewed_at > LEASE_TTL_SEC - HEARTBEAT_SEC:
+                logging.warning("cluster: lease not renewed in time, stepping down")
+                await self._demote()
+            await asyncio.sleep(HEARTBEAT_SEC)
+
+    async def beat(self):
+        await db_write(heartbeat, self.worker_id)
+        since = datetime.utcnow() - timedelta(seconds=WORKER_TTL_SEC)
+        members = sorted(set(await db_call(live_workers, since)) | {self.worker_id})
+        CLUSTER_WORKERS.set(len(members))
+        if members != self.members:
+            logging.info("cluster: workers %s", ", ".join(members))
+            self.members = members
+            if self.on_members:
+                self.on_members()
+        if not self.lead:
+            return
+        t = time.monotonic()
+        if await db_write(acquire_lease, LEADER_LEASE, self.worker_id, LEASE_TTL_SEC):
+            self.renewed_at = t
+            if not self.leader:
+                await self._elect()
+            await db_write(prune_cluster, datetime.utcnow() - PRUNE_AFTER)
+            if self.on_tick:
+                self.on_tick()
+        elif self.leader:
+            logging.warning("cluster: leader lease taken over")
+            await self._demote()
+
+    async def _elect(self):
+        logging.info("cluster: %s is the leader", self.worker_id)
+        self.leader = True
+        CLUSTER_LEADER.set(1)
+        if self.on_elected:
+            await self.on_elected()
+
+    async def _demote(self):
+        logging.info("cluster: %s is no longer the leader", self.worker_id)
+        self.leader = False
+        CLUSTER_LEADER.set(0)
+        if self.on_demoted:
+            await self.on_demoted()
@@ -1,9 +1,46 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, UniqueConstraint
-from sqlalchemy.orm import declarative_base, sessionmaker
-from datetime import datetime
+import asyncio, json, logging, os, queue, re, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from sqlalchemy import create_engine, event, inspect, select, update, delete, func, text, Column, Integer, String, Text, DateTime, LargeBinary, Index, UniqueConstraint
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import aliased, declarative_base, sessionmaker
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+from utils.metrics import Counter, Histogram
+
+# WAL lets readers run while a write is in progress; NORMAL sync is safe under WAL (a crash can lose the
+# last commits, never corrupt the file). busy_timeout covers the rare overlap with another process.
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+DB_READERS = int(os.getenv("DB_READERS") or 4)
+WRITE_BATCH_MAX = 64
+WRITE_BATCH_WINDOW_SEC = 0.002
+INGEST_CHUNK_ROWS = 200  # rows per ingest transaction, so handler writes never wait behind a whole cycle
 
 engine = create_engine('sqlite:///storage/nxt.db', echo=False, future=True, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False, future=True)
+
+@event.listens_for(engine, "connect")
+def _sqlite_pragmas(dbapi_conn, _record):
+    cur = dbapi_conn.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cur.execute(pragma)
+    cur.close()
+    dbapi_conn.isolation_level = None  # transactions are begun in _begin below
+
+@event.listens_for(engine, "begin")
+def _begin(conn):
+    # The writer takes the write lock up front: with several processes on one file, a transaction that
+    # reads first and writes later could otherwise fail with SQLITE_BUSY instead of waiting busy_timeout.
+    immediate = conn.get_execution_options().get("immediate") or threading.current_thread() is writer.thread
+    conn.exec_driver_sql("BEGIN IMMEDIATE" if immediate else "BEGIN")
+
 Base = declarative_base()
 
 class Item(Base):
@@ -14,9 +51,513 @@ class Item(Base):
     summary = Column(String, nullable=True)
     source = Column(String, nullable=True)
     image_url = Column(String, nullable=True)
-    status = Column(String, default="new")  # new, approved, posted, skipped
+    status = Column(String, default="new")  # new, approved, posted, skipped, duplicate
     scheduled_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    fingerprint = Column(LargeBinary, nullable=True)  # MinHash signature of the original title + summary
+    duplicate_of = Column(String, nullable=True)  # url of the item this one near-duplicates
+    __table_args__ = (
+        Index('ix_items_status_id', 'status', 'id'),
+        Index('ix_items_created_at', 'created_at'),
+        Index('ix_items_scheduled_at', 'scheduled_at'),
+    )
+
+class ItemArchive(Base):
+    # Posted, skipped and duplicate items moved out of the hot table; ids are kept.
+    __tablename__ = 'items_archive'
+    id = Column(Integer, primary_key=True)
+    url = Column(String, nullable=False, unique=True)
+    title = Column(String, nullable=False)
+    summary = Column(String, nullable=True)
+    source = Column(String, nullable=True)
+    image_url = Column(String, nullable=True)
+    status = Column(String)
+    scheduled_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime)
+    duplicate_of = Column(String, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+ARCHIVE_STATUSES = ("posted", "skipped", "duplicate")
+ARCHIVE_COLUMNS = ["id", "url", "title", "summary", "source", "image_url", "status", "scheduled_at", "created_at", "duplicate_of"]
+
+class RewriteCache(Base):
+    __tablename__ = 'rewrite_cache'
+    key = Column(String, primary_key=True)  # model:prompt_hash:input_hash
+    text = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Outbox(Base):
+    __tablename__ = 'outbox'
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(String, nullable=False)
+    method = Column(String, nullable=False)  # Bot method name: send_message, send_photo, ...
+    payload = Column(Text, nullable=False)  # JSON kwargs for the method
+    item_id = Column(Integer, nullable=True)
+    status = Column(String, default="pending")  # pending, sent, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index('ix_outbox_status_due', 'status', 'next_attempt_at'),)
+
+class ScheduledPost(Base):
+    __tablename__ = 'scheduled_posts'
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)  # item, text
+    item_id = Column(Integer, nullable=True)
+    text = Column(Text, nullable=True)
+    due_at = Column(DateTime, nullable=False)  # UTC
+    status = Column(String, default="pending")  # pending, done, cancelled
+    created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index('ix_scheduled_posts_status_due', 'status', 'due_at'),)
+
+class MediaFile(Base):
+    # Telegram file_id of media uploaded once, keyed by "url:<image url>" or "sha256:<file hash>".
+    __tablename__ = 'media_files'
+    key = Column(String, primary_key=True)
+    file_id = Column(String, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class Lease(Base):
+    # A named lease held by one worker until expires_at (UTC); renewed by its holder, taken over once expired.
+    __tablename__ = 'leases'
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+class Worker(Base):
+    __tablename__ = 'workers'
+    id = Column(String, primary_key=True)
+    seen_at = Column(DateTime, nullable=False)  # last heartbeat, UTC
+    started_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index('ix_workers_seen_at', 'seen_at'),)
+
+class Claim(Base):
+    # Which worker processes a new item URL (rewrite, ingest, review); see claim_urls.
+    __tablename__ = 'claims'
+    url = Column(String, primary_key=True)
+    worker = Column(String, nullable=False)
+    claimed_at = Column(DateTime, nullable=False)
+    __table_args__ = (Index('ix_claims_claimed_at', 'claimed_at'),)
 
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    # One immediate transaction, so several processes starting on the same file wait for each other.
+    with engine.connect().execution_options(immediate=True) as conn, conn.begin():
+        legacy_schedules = not inspect(conn).has_table("scheduled_posts")
+        Base.metadata.create_all(bind=conn)
+        _migrate(conn)
+        if legacy_schedules:
+            _schedule_legacy_posts(conn)
+        _create_search_index(conn)
+
+def _migrate(conn):
+    # Lightweight migration for existing nxt.db files: add missing nullable columns and indexes.
+    insp = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        existing = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name not in existing and col.nullable and not col.primary_key:
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(engine.dialect)}'))
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def _schedule_legacy_posts(conn):
+    # Once, when scheduled_posts is created: before it, /schedule_at and "+60м" only set items.scheduled_at.
+    # Give every approved item scheduled that way a pending post, so upgrading does not drop its publication.
+    n = conn.execute(text(
+        "INSERT INTO scheduled_posts (kind, item_id, due_at, status, created_at) "
+        "SELECT 'item', id, scheduled_at, 'pending', :now FROM items "
+        "WHERE status = 'approved' AND scheduled_at IS NOT NULL AND NOT EXISTS "
+        "(SELECT 1 FROM scheduled_posts p WHERE p.item_id = items.id AND p.status = 'pending')"), {"now": datetime.utcnow()}).rowcount
+    if n:
+        logging.info(f"Scheduled {n} posts left from before scheduled_posts")
+
+DB_SECONDS = Histogram("nxt_db_seconds", "Ingest DB operation time", ["op"])
+ITEMS_INSERTED = Counter("nxt_items_inserted_total", "Items inserted by ingest")
+WRITE_BATCH = Histogram("nxt_db_write_batch_size", "Writes committed per transaction", buckets=(1, 2, 4, 8, 16, 32, 64))
+
+class DBWriter:
+    # The only thread that writes. Ops are fn(*args, session=...) and run in submission order; whatever is
+    # queued while a commit is in flight (plus a short window) shares the next transaction, so bursts of small
+    # writes cost one commit. If a batch fails it is rolled back and each op is retried in its own transaction.
+    def __init__(self, max_batch: int = WRITE_BATCH_MAX, window: float = WRITE_BATCH_WINDOW_SEC):
+        self.max_batch = max_batch
+        self.window = window
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        fut = Future()
+        self.queue.put((fut, fn, args, kwargs))
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                    self.thread.start()
+        return fut
+
+    def call(self, fn: Callable, *args, **kwargs):
+        # Blocking variant for worker threads. An op that writes more must pass its own session along.
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("nested write on the db writer thread; pass session=")
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            # Ops whose caller was cancelled while they waited are dropped; the rest can no longer be cancelled.
+            batch = [op for op in batch if op[0].set_running_or_notify_cancel()]
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        try:
+            with DB_SECONDS.time("write"), SessionLocal.begin() as session:
+                results = [fn(*args, session=session, **kwargs) for _, fn, args, kwargs in batch]
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][0].set_exception(e)
+                return
+            logging.warning("db write batch of %s failed, retrying one by one: %r", len(batch), e)
+            for op in batch:
+                self._commit([op])
+            return
+        WRITE_BATCH.observe(len(batch))
+        for (fut, *_), result in zip(batch, results):
+            fut.set_result(result)
+
+writer = DBWriter()
+_readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="db-read")
+
+async def db_call(fn: Callable, *args, **kwargs):
+    # Run a blocking DB function off the event loop (reads; writes inside it go through the writer).
+    return await asyncio.get_running_loop().run_in_executor(_readers, partial(fn, *args, **kwargs))
+
+async def db_write(fn: Callable, *args, **kwargs):
+    # fn(*args, session=..., **kwargs) in a batched transaction on the writer thread.
+    return await asyncio.wrap_future(writer.submit(fn, *args, **kwargs))
+
+# SQLite caps bound parameters per statement; stay well below the limit.
+SQLITE_MAX_VARS = 900
+SEEN_URLS_MAX = 200_000
+# URLs known to be stored, kept across fetch cycles so repeat entries never reach the DB.
+_seen_urls = set()
+
+def _chunks(seq: List, n: int):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+def new_urls(urls: Iterable[str]) -> List[str]:
+    # Unique candidate URLs not stored yet, in input order. One IN query per chunk for cache misses.
+    pending = [u for u in dict.fromkeys(urls) if u not in _seen_urls]
+    if not pending:
+        return []
+    if len(_seen_urls) > SEEN_URLS_MAX:
+        _seen_urls.clear()
+    with DB_SECONDS.time("dedup"), SessionLocal() as session:
+        for chunk in _chunks(pending, SQLITE_MAX_VARS):
+            _seen_urls.update(session.scalars(select(Item.url).where(Item.url.in_(chunk))))
+            _seen_urls.update(session.scalars(select(ItemArchive.url).where(ItemArchive.url.in_(chunk))))
+    return [u for u in pending if u not in _seen_urls]
+
+def ingest_items(rows: List[Dict], session=None, on_insert: Callable = None) -> List[Item]:
+    # Insert a batch of item dicts in short transactions; URLs already present are ignored.
+    # Returns only the rows that were actually inserted. on_insert(items, session) runs in each chunk's
+    # transaction, so whatever it queues (review messages) is stored together with the items or not at all.
+    rows = list({r["url"]: r for r in reversed(rows)}.values())[::-1]
+    if not rows:
+        return []
+    if session is None:
+        added = [it for chunk in _chunks(rows, INGEST_CHUNK_ROWS) for it in writer.call(ingest_items, chunk, on_insert=on_insert)]
+        ITEMS_INSERTED.inc(amount=len(added))
+        _seen_urls.update(r["url"] for r in rows)
+        return added
+    stmt = insert(Item).on_conflict_do_nothing(index_elements=["url"]).returning(Item)
+    with DB_SECONDS.time("insert"):
+        items = list(session.scalars(stmt, rows))
+    if on_insert and items:
+        on_insert(items, session)
+    return items
+
+def get_rewrites(keys: Iterable[str]) -> Dict[str, str]:
+    keys = list(dict.fromkeys(keys))
+    found = {}
+    with SessionLocal() as session:
+        for chunk in _chunks(keys, SQLITE_MAX_VARS):
+            found.update(session.execute(select(RewriteCache.key, RewriteCache.text).where(RewriteCache.key.in_(chunk))).all())
+    return found
+
+def put_rewrites(pairs: Dict[str, str], session=None):
+    if not pairs:
+        return
+    if session is None:
+        return writer.call(put_rewrites, pairs)
+    stmt = insert(RewriteCache).on_conflict_do_nothing(index_elements=["key"])
+    session.execute(stmt, [{"key": k, "text": v} for k, v in pairs.items()])
+
+def get_file_id(key: str) -> Optional[str]:
+    with SessionLocal() as session:
+        return session.scalar(select(MediaFile.file_id).where(MediaFile.key == key))
+
+def put_file_id(key: str, file_id: Optional[str], session=None):
+    # file_id=None forgets the key (e.g. Telegram rejected a stale id).
+    if session is None:
+        return writer.call(put_file_id, key, file_id)
+    if file_id is None:
+        session.execute(delete(MediaFile).where(MediaFile.key == key))
+    else:
+        session.execute(insert(MediaFile).values(key=key, file_id=file_id)
+                        .on_conflict_do_update(index_elements=["key"], set_={"file_id": file_id}))
+
+def enqueue_messages(messages: List[Dict], session=None) -> int:
+    # messages: {"chat_id", "method", "payload": dict, "item_id"?}; stored in one transaction,
+    # or in the caller's transaction when a session is given.
+    if not messages:
+        return 0
+    if session is None:
+        return writer.call(enqueue_messages, messages)
+    rows = [{"chat_id": str(m["chat_id"]), "method": m["method"], "payload": json.dumps(m["payload"], ensure_ascii=False),
+             "item_id": m.get("item_id")} for m in messages]
+    session.execute(insert(Outbox), rows)
+    return len(rows)
+
+def due_messages(limit: int = 100) -> List[Outbox]:
+    # Due messages, skipping any queued behind an earlier message of the same chat that is still backing off.
+    now = datetime.utcnow()
+    earlier = aliased(Outbox)
+    blocked = select(earlier.id).where(earlier.chat_id == Outbox.chat_id, earlier.status == "pending",
+                                       earlier.next_attempt_at > now, earlier.id < Outbox.id).exists()
+    with SessionLocal() as session:
+        return list(session.scalars(select(Outbox).where(Outbox.status == "pending", Outbox.next_attempt_at <= now, ~blocked)
+                                    .order_by(Outbox.id).limit(limit)))
+
+def pending_messages() -> int:
+    with SessionLocal() as session:
+        return session.scalar(select(func.count()).select_from(Outbox).where(Outbox.status == "pending"))
+
+def next_message_due() -> Optional[datetime]:
+    with SessionLocal() as session:
+        return session.scalar(select(func.min(Outbox.next_attempt_at)).where(Outbox.status == "pending"))
+
+def mark_message(msg_id: int, status: str, error: Optional[str] = None, retry_in: Optional[float] = None, session=None):
+    if session is None:
+        return writer.call(mark_message, msg_id, status, error, retry_in)
+    values = {"status": status, "attempts": Outbox.attempts + 1, "last_error": error}
+    if retry_in is not None:
+        values["next_attempt_at"] = datetime.utcnow() + timedelta(seconds=retry_in)
+    session.execute(update(Outbox).where(Outbox.id == msg_id).values(**values))
+
+def prune_outbox(older_than: timedelta, batch: int = 1000) -> int:
+    # Delete sent and failed messages created before now - older_than, a batch per write like archive_items.
+    cutoff = datetime.utcnow() - older_than
+    removed = 0
+    while True:
+        n = writer.call(_prune_outbox_batch, cutoff, batch)
+        if not n:
+            return removed
+        removed += n
+
+def _prune_outbox_batch(cutoff: datetime, batch: int, session) -> int:
+    ids = select(Outbox.id).where(Outbox.status.in_(("sent", "failed")), Outbox.created_at < cutoff).order_by(Outbox.id).limit(batch)
+    return session.execute(delete(Outbox).where(Outbox.id.in_(ids))).rowcount
+
+def schedule_post(due_at: datetime, item_id: Optional[int] = None, text: Optional[str] = None, session=None) -> int:
+    if session is None:
+        return writer.call(schedule_post, due_at, item_id, text)
+    post = ScheduledPost(kind="text" if item_id is None else "item", item_id=item_id, text=text, due_at=due_at)
+    session.add(post)
+    session.flush()
+    return post.id
+
+def due_posts(limit: int = 100) -> List[int]:
+    with SessionLocal() as session:
+        return list(session.scalars(select(ScheduledPost.id).where(ScheduledPost.status == "pending", ScheduledPost.due_at <= datetime.utcnow())
+                                    .order_by(ScheduledPost.due_at).limit(limit)))
+
+def next_post_due() -> Optional[datetime]:
+    with SessionLocal() as session:
+        return session.scalar(select(func.min(ScheduledPost.due_at)).where(ScheduledPost.status == "pending"))
+
+def approved_items(limit: int = 10) -> List[Item]:
+    with SessionLocal() as session:
+        return list(session.scalars(select(Item).where(Item.status == "approved").order_by(Item.id).limit(limit)))
+
+def get_items(ids: List[int]) -> List[Item]:
+    # In the order given; ids no longer in the hot table are left out.
+    with SessionLocal() as session:
+        found = {it.id: it for it in session.scalars(select(Item).where(Item.id.in_(ids)))}
+    return [found[i] for i in ids if i in found]
+
+def last_created_at() -> Optional[datetime]:
+    with SessionLocal() as session:
+        return session.scalar(select(func.max(Item.created_at)))
+
+def status_counts() -> Dict[str, int]:
+    # All per-status counts in one pass over ix_items_status_id.
+    with SessionLocal() as session:
+        return dict(session.execute(select(Item.status, func.count()).group_by(Item.status)).all())
+
+def archive_items(older_than: timedelta, batch: int = 1000) -> int:
+    # Move posted/skipped/duplicate items created before now - older_than into items_archive, in short transactions.
+    # Each batch is its own write, so handler writes interleave with a long archive run.
+    cutoff = datetime.utcnow() - older_than
+    moved = 0
+    while True:
+        n = writer.call(_archive_batch, cutoff, batch)
+        if not n:
+            break
+        moved += n
+    # The move rewrote every archived row in the search index; merge its segments the same way, step by step.
+    while moved and search_available and writer.call(_merge_search_index):
+        pass
+    return moved
+
+def _archive_batch(cutoff: datetime, batch: int, session) -> int:
+    cols = ", ".join(ARCHIVE_COLUMNS)
+    ids = list(session.scalars(select(Item.id).where(Item.status.in_(ARCHIVE_STATUSES), Item.created_at < cutoff)
+                               .order_by(Item.id).limit(batch)))
+    if ids:
+        session.execute(text(f"INSERT OR IGNORE INTO items_archive ({cols}, archived_at) "
+                             f"SELECT {cols}, :now FROM items WHERE id IN ({', '.join(map(str, ids))})"), {"now": datetime.utcnow()})
+        session.execute(delete(Item).where(Item.id.in_(ids)))
+    return len(ids)
+
+# Full-text index over items and items_archive (rowid = item id), kept in sync by triggers: the archive move
+# inserts the archived copy before deleting the hot row, so the delete only drops the entry when no archived
+# copy exists. The insert triggers delete first instead of INSERT OR REPLACE: the archive's INSERT OR IGNORE
+# overrides a trigger's conflict mode, and FTS5 rejects IGNORE. Prefix indexes make 2-3 character prefix
+# queries index lookups instead of term scans.
+SEARCH_TRIGGERS = {
+    "items_fts_ai": "AFTER INSERT ON items BEGIN DELETE FROM items_fts WHERE rowid = new.id; "
+                    "INSERT INTO items_fts(rowid, title, summary, source) VALUES (new.id, new.title, new.summary, new.source); END",
+    "items_fts_au": "AFTER UPDATE OF title, summary, source ON items BEGIN "
+                    "UPDATE items_fts SET title = new.title, summary = new.summary, source = new.source WHERE rowid = new.id; END",
+    "items_fts_ad": "AFTER DELETE ON items BEGIN "
+                    "DELETE FROM items_fts WHERE rowid = old.id AND NOT EXISTS (SELECT 1 FROM items_archive WHERE id = old.id); END",
+    "items_archive_fts_ai": "AFTER INSERT ON items_archive BEGIN DELETE FROM items_fts WHERE rowid = new.id; "
+                            "INSERT INTO items_fts(rowid, title, summary, source) VALUES (new.id, new.title, new.summary, new.source); END",
+    "items_archive_fts_ad": "AFTER DELETE ON items_archive BEGIN "
+                            "DELETE FROM items_fts WHERE rowid = old.id AND NOT EXISTS (SELECT 1 FROM items WHERE id = old.id); END",
+}
+SEARCH_WEIGHTS = (10.0, 2.0, 1.0)  # bm25 weight of title, summary, source
+SEARCH_CANDIDATES = 1000  # a very common word matches most of the archive; rank only its newest matches
+search_available = False
+
+def _create_search_index(conn):
+    global search_available
+    exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'items_fts'")).first()
+    if not exists:
+        try:
+            with conn.begin_nested():
+                conn.execute(text("CREATE VIRTUAL TABLE items_fts USING fts5(title, summary, source, "
+                                  "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"))
+        except Exception as e:
+            logging.warning(f"Search disabled, SQLite has no FTS5: {e}")
+            return
+        # Backfill once; from here on the triggers keep the index current.
+        for table in ("items_archive", "items"):
+            conn.execute(text(f"INSERT OR REPLACE INTO items_fts(rowid, title, summary, source) "
+                              f"SELECT id, title, summary, source FROM {table}"))
+    for name, body in SEARCH_TRIGGERS.items():
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+    search_available = True
+
+SEARCH_MERGE_PAGES = 200  # index pages written per merge step
+
+def _merge_search_index(session) -> bool:
+    # One bounded FTS5 merge step; False once there is nothing left to merge.
+    before = session.scalar(text("SELECT total_changes()"))
+    session.execute(text("INSERT INTO items_fts(items_fts, rank) VALUES ('merge', :pages)"), {"pages": -SEARCH_MERGE_PAGES})
+    return session.scalar(text("SELECT total_changes()")) - before >= 2
+
+def search_words(q: str) -> List[str]:
+    return re.findall(r"\w+", q.lower())[:16]
+
+def search_query(q: str) -> Optional[str]:
+    # User text -> FTS5 query: every word quoted (no operators or column filters leak through) and matched
+    # as a prefix, all words required.
+    return " ".join(f'"{w}"*' for w in search_words(q)) or None
+
+def search_items(q: str, limit: int = 5, offset: int = 0) -> List[Item]:
+    # Best bm25 matches among the newest SEARCH_CANDIDATES, as Item or ItemArchive rows. Only the candidates
+    # are scored: FTS5 walks a match in rowid order and stops at the limit.
+    match = search_query(q)
+    if not match or not search_available:
+        return []
+    weights = ", ".join(map(str, SEARCH_WEIGHTS))
+    with SessionLocal() as session:
+        ids = list(session.scalars(text(
+            f"SELECT rowid FROM (SELECT rowid, bm25(items_fts, {weights}) AS score FROM items_fts "
+            f"WHERE items_fts MATCH :match ORDER BY rowid DESC LIMIT {SEARCH_CANDIDATES}) "
+            f"ORDER BY score, rowid DESC LIMIT :limit OFFSET :offset"), {"match": match, "limit": limit, "offset": offset}))
+        found = {}
+        for model in (ItemArchive, Item):
+            found.update({it.id: it for it in session.scalars(select(model).where(model.id.in_(ids)))})
+    return [found[i] for i in ids if i in found]
+
+def recent_fingerprints(since: datetime) -> List[tuple]:
+    # (url, fingerprint, created_at) of items that may still have near-duplicates arriving.
+    with SessionLocal() as session:
+        return session.execute(select(Item.url, Item.fingerprint, Item.created_at)
+                               .where(Item.created_at >= since, Item.fingerprint.is_not(None), Item.duplicate_of.is_(None))).all()
+
+def acquire_lease(name: str, holder: str, ttl: float, session=None) -> bool:
+    # Take or renew the lease; True if `holder` has it for the next ttl seconds.
+    if session is None:
+        return writer.call(acquire_lease, name, holder, ttl)
+    now = datetime.utcnow()
+    stmt = insert(Lease).values(name=name, holder=holder, expires_at=now + timedelta(seconds=ttl))
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["name"], set_={"holder": stmt.excluded.holder, "expires_at": stmt.excluded.expires_at},
+        where=(Lease.holder == stmt.excluded.holder) | (Lease.expires_at < now)))
+    return session.scalar(select(Lease.holder).where(Lease.name == name)) == holder
+
+def release_lease(name: str, holder: str, session=None):
+    if session is None:
+        return writer.call(release_lease, name, holder)
+    session.execute(delete(Lease).where(Lease.name == name, Lease.holder == holder))
+
+def heartbeat(worker_id: str, session=None):
+    if session is None:
+        return writer.call(heartbeat, worker_id)
+    stmt = insert(Worker).values(id=worker_id, seen_at=datetime.utcnow())
+    session.execute(stmt.on_conflict_do_update(index_elements=["id"], set_={"seen_at": stmt.excluded.seen_at}))
+
+def leave(worker_id: str, session=None):
+    if session is None:
+        return writer.call(leave, worker_id)
+    session.execute(delete(Worker).where(Worker.id == worker_id))
+
+def live_workers(since: datetime) -> List[str]:
+    with SessionLocal() as session:
+        return list(session.scalars(select(Worker.id).where(Worker.seen_at >= since).order_by(Worker.id)))
+
+def prune_cluster(before: datetime, session=None) -> int:
+    # Forget workers and claims not touched since `before`.
+    if session is None:
+        return writer.call(prune_cluster, before)
+    n = session.execute(delete(Worker).where(Worker.seen_at < before)).rowcount
+    return n + session.execute(delete(Claim).where(Claim.claimed_at < before)).rowcount
+
+def claim_urls(urls: List[str], worker: str, stale_after: float, session=None) -> List[str]:
+    # The URLs this worker may process. A URL goes to the first worker that claims it; asking again returns
+    # the same answer, and a claim older than stale_after seconds (its worker died before storing the item)
+    # can be taken over.
+    if session is None:
+        return [u for chunk in _chunks(list(urls), SQLITE_MAX_VARS) for u in writer.call(claim_urls, chunk, worker, stale_after)]
+    if not urls:
+        return []
+    now = datetime.utcnow()
+    stmt = insert(Claim).values([{"url": u, "worker": worker, "claimed_at": now} for u in urls])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=["url"], set_={"worker": stmt.excluded.worker, "claimed_at": stmt.excluded.claimed_at},
+        where=(Claim.worker != stmt.excluded.worker) & (Claim.claimed_at < now - timedelta(seconds=stale_after))))
+    mine = set(session.scalars(select(Claim.url).where(Claim.url.in_(urls), Claim.worker == worker)))
+    return [u for u in urls if u in mine]
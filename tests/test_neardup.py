@@ -0,0 +1,44 @@
+from datetime import datetime, timedelta
+from fetchers.neardup import NearDupIndex, minhash, pack, similarity, unpack
+
+TEXT = "NaVi beat FaZe in the IEM Cologne grand final after three maps"
+
+def test_minhash_is_stable_and_skips_short_texts():
+    assert minhash(TEXT) == minhash(TEXT)
+    assert minhash("short text") is None
+    assert unpack(pack(minhash(TEXT))) == minhash(TEXT)
+
+def test_find_matches_rewording_but_not_unrelated():
+    index = NearDupIndex()
+    index.add("http://hltv/a/1", minhash(TEXT))
+    reworded = minhash("NaVi beat FaZe in the IEM Cologne grand final after three maps!")
+    assert similarity(reworded, minhash(TEXT)) >= index.threshold
+    assert index.find(reworded) == "http://hltv/a/1"
+    assert index.find(minhash("Valve ships a new Dota patch with hero changes and item reworks")) is None
+
+def test_find_excludes_own_key():
+    # A retried batch finds the entries it added before failing; an item must not duplicate itself.
+    index = NearDupIndex()
+    sig = minhash(TEXT)
+    index.add("http://hltv/a/1", sig)
+    assert index.find(sig, exclude="http://hltv/a/1") is None
+    index.add("http://dust2/a/9", sig)
+    assert index.find(sig, exclude="http://hltv/a/1") == "http://dust2/a/9"
+
+def test_prune_drops_entries_outside_window():
+    index = NearDupIndex(window=timedelta(hours=1))
+    sig = minhash(TEXT)
+    index.add("http://hltv/a/1", sig, datetime.utcnow() - timedelta(hours=2))
+    index.prune()
+    assert index.find(sig) is None and not index.entries
+
+def test_mark_near_duplicates_retry_keeps_item(monkeypatch):
+    import bot
+    monkeypatch.setattr(bot, "near_dups", NearDupIndex())
+    monkeypatch.setattr(bot, "cluster", None)
+    row = lambda: {"url": "http://hltv/a/1", "fp_text": TEXT, "status": "new", "rewrite": True}
+    first, retry = [row()], [row()]
+    assert bot.mark_near_duplicates(first) == 0
+    # The same feed polled again after ingest failed: the row is not a duplicate of itself.
+    assert bot.mark_near_duplicates(retry) == 0
+    assert retry[0]["status"] == "new" and retry[0]["duplicate_of"] is None
@@ -0,0 +1,37 @@
+import time
+from fetchers.rss import FeedCache, parse_feed_bytes
+
+def rss(ids, dated=True, oldest_first=False):
+    def item(i):
+        date = f"<pubDate>{time.strftime('%a, %d %b %Y %H:%M:%S +0000', time.gmtime(1700000000 + i * 60))}</pubDate>" if dated else ""
+        return f"<item><title>t{i}</title><link>http://a/{i}</link><guid>g{i}</guid>{date}</item>"
+    ids = ids if oldest_first else ids[::-1]
+    return f"<rss><channel><title>x</title>{''.join(map(item, ids))}</channel></rss>".encode()
+
+def poll(cache, body, **kw):
+    # One fetch_feeds step for a single feed: parse with the stored marks, then keep the new ones.
+    seen, high_water = cache.marks("u")
+    items = parse_feed_bytes(body, seen_guids=seen, high_water=high_water, **kw)
+    cache.update_marks("u", items)
+    cache.save()
+    return [it["guid"] for it in items]
+
+def test_new_entries_in_either_order(tmp_path):
+    for oldest_first in (False, True):
+        cache = FeedCache(str(tmp_path / f"cache{oldest_first}.json"))
+        assert len(poll(cache, rss(list(range(10)), oldest_first=oldest_first))) == 10
+        assert poll(cache, rss(list(range(10)), oldest_first=oldest_first)) == []
+        assert sorted(poll(cache, rss(list(range(15)), oldest_first=oldest_first))) == [f"g{i}" for i in range(10, 15)]
+
+def test_undated_feed_appending_at_the_end(tmp_path):
+    # No dates, so the order is unknown: known GUIDs are skipped, never taken as the end of the new entries.
+    cache = FeedCache(str(tmp_path / "cache.json"))
+    assert len(poll(cache, rss(list(range(5)), dated=False, oldest_first=True))) == 5
+    assert poll(cache, rss(list(range(8)), dated=False, oldest_first=True)) == ["g5", "g6", "g7"]
+
+def test_cap_keeps_newest_entries(tmp_path):
+    for oldest_first in (False, True):
+        cache = FeedCache(str(tmp_path / f"cache{oldest_first}.json"))
+        poll(cache, rss(list(range(5)), oldest_first=oldest_first))
+        new = poll(cache, rss(list(range(125)), oldest_first=oldest_first), max_entries=50)
+        assert sorted(new, key=lambda g: int(g[1:])) == [f"g{i}" for i in range(75, 125)]
@@ -0,0 +1,43 @@
+import logging
+from aiohttp import web
+
+class HealthServer:
+    # Binds before the rest of the bot is loaded and answers /health right away. The bot adds its own routes
+    # (metrics, webhook) once loaded and sets `ready` when it is up; until then /ready and any unknown path
+    # answer 503, which Telegram treats as "retry later".
+    def __init__(self, port: int, host: str = "0.0.0.0"):
+        self.port = port
+        self.host = host
+        self.routes = {}
+        self.ready = False
+        self.runner = None
+
+    def add(self, method: str, path: str, handler):
+        self.routes[(method, path)] = handler
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/", self.health)
+        app.router.add_get("/health", self.health)
+        app.router.add_get("/ready", self.readiness)
+        app.router.add_route("*", "/{path:.*}", self.dispatch)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host=self.host, port=self.port).start()
+        logging.info(f"Health server on :{self.port}")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def health(self, request):
+        return web.Response(text="OK", status=200)
+
+    async def readiness(self, request):
+        return web.Response(text="OK" if self.ready else "starting", status=200 if self.ready else 503)
+
+    async def dispatch(self, request):
+        handler = self.routes.get((request.method, request.path))
+        if handler is None:
+            return web.Response(status=404 if self.ready else 503)
+        return await handler(request)
@@ -0,0 +1,90 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Minimal Prometheus text-format metrics. Recording is a dict lookup plus a few additions; updates from
+# worker threads are not locked, which at worst loses a rare increment.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+REGISTRY: List["_Metric"] = []
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.series: Dict[Tuple, object] = {}
+        REGISTRY.append(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self.series.items()]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.series[labels] = value
+
+    def render(self) -> List[str]:
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in self.series.items()]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        s = self.series.get(labels)
+        if s is None:
+            s = self.series.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0, 0])
+        s[0][bisect_left(self.buckets, value)] += 1
+        s[1] += value
+        s[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, *labels)
+
+    def render(self) -> List[str]:
+        out = self.header()
+        for k, (counts, total, n) in self.series.items():
+            acc = 0
+            for le, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = 'le="+Inf"' if le == float("inf") else f'le="{le}"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {total}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {n}")
+        return out
+
+def render() -> str:
+    lines = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,94 @@
+import asyncio, builtins, importlib, logging, os, sys, threading, time
+from contextlib import contextmanager
+from typing import List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORT_MIN_SEC = 0.002
+
+class StartupProfile:
+    # Wall time of startup phases and of the first import of each module the bot's own code imports
+    # (cumulative, so a module's line includes the modules it pulls in, listed below it).
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.started = time.perf_counter()
+        self.phases: List[tuple] = []
+        self.imports: List[list] = []
+        self.depth = 0
+        self.ready_after = None
+
+    @contextmanager
+    def phase(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - t))
+
+    def ready(self):
+        self.ready_after = time.perf_counter() - self.started
+        logging.info("Ready in %.2fs", self.ready_after)
+
+    def load(self, module: str):
+        # Import `module` (in a worker thread, while the health server answers), timing nested imports.
+        if not self.enabled:
+            with self.phase(f"import {module}"):
+                return importlib.import_module(module)
+        original = builtins.__import__
+        ours = {}
+        owner = threading.get_ident()
+
+        def timed(name, globals=None, locals=None, fromlist=(), level=0):
+            caller = (globals or {}).get("__name__", "")
+            if caller not in ours:
+                path = getattr(sys.modules.get(caller), "__file__", None) or ""
+                ours[caller] = path.startswith(ROOT) and os.sep + ".venv" not in path
+            new = name not in sys.modules or any(f"{name}.{f}" not in sys.modules for f in fromlist or ())
+            if level or not new or not ours[caller] or threading.get_ident() != owner:
+                return original(name, globals, locals, fromlist, level)
+            entry = [self.depth, name, None]
+            self.imports.append(entry)
+            self.depth += 1
+            t = time.perf_counter()
+            try:
+                return original(name, globals, locals, fromlist, level)
+            finally:
+                self.depth -= 1
+                entry[2] = time.perf_counter() - t
+
+        builtins.__import__ = timed
+        entry = [0, module, None]
+        self.imports.append(entry)
+        self.depth = 1
+        t = time.perf_counter()
+        try:
+            return importlib.import_module(module)
+        finally:
+            builtins.__import__ = original
+            self.depth = 0
+            entry[2] = time.perf_counter() - t
+
+    def report(self) -> str:
+        lines = [f"startup: ready in {self.ready_after or time.perf_counter() - self.started:.3f}s", "phases:"]
+        lines += [f"  {name:<40} {sec * 1000:8.1f} ms" for name, sec in self.phases]
+        if self.imports:
+            lines.append("imports (first import, cumulative):")
+            lines += [f"  {'  ' * depth + name:<40} {sec * 1000:8.1f} ms"
+                      for depth, name, sec in self.imports if sec is not None and sec >= REPORT_MIN_SEC]
+        return "\n".join(lines)
+
+def run(module: str, argv: List[str] = None):
+    # Script entry: bind the health server first, then import `module` and run its main(server, profile).
+    argv = sys.argv[1:] if argv is None else argv
+    profile = StartupProfile(enabled="--profile-startup" in argv)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run(module, profile))
+
+async def _run(module: str, profile: StartupProfile):
+    with profile.phase("health server"):
+        from dotenv import load_dotenv
+        from utils.health import HealthServer
+        load_dotenv()
+        server = HealthServer(int(os.getenv("PORT", 8080)))
+        await server.start()
+    mod = await asyncio.to_thread(profile.load, module)
+    await mod.main(server=server, profile=profile)